@@ -0,0 +1,317 @@
+"""
+Benchmarks for JQL over a generated corpus.
+
+    python bench.py --files 500 --width 20 --depth 6 --output results.json
+    python bench.py --compare results.json
+
+Each stage is timed separately (repeat times, keeping the best run) and the
+results can be written as JSON and compared against an earlier run.
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import contextlib
+import subprocess
+
+import jql
+from jql import Queue, PropertyPath, create_tree, get_value
+from comparers import Comparisons
+from columns import ColumnStore
+from evaluators import SomeEvaluator as Some
+from evaluators import AllEvaluator as All
+
+
+NAMES = ['Jon', 'Arya', 'Sansa', 'Bran', 'Rickon', 'Robb', 'Ghost', 'Nymeria', 'Summer', 'Shaggydog']
+TITLES = ['King in the North', 'Crow', 'Bastard', 'Rightful King of Westeros', 'Lord Commander', 'Warg']
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Benchmark JQL stages over a generated corpus')
+
+    parser.add_argument('--files', type=int, default=200, help='Number of documents in the corpus (default: 200)')
+    parser.add_argument('--fields', type=int, default=20, help='Extra scalar properties per document (default: 20)')
+    parser.add_argument('--width', type=int, default=10, help='Number of elements in each array (default: 10)')
+    parser.add_argument('--depth', type=int, default=4, help='Levels of nested objects per document (default: 4)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the corpus generator (default: 0)')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs of each stage, the fastest is kept (default: 5)')
+    parser.add_argument('--corpus', type=str, default=None, help='Directory to write the corpus to and keep (default: a temporary directory)')
+    parser.add_argument('--output', type=str, default=None, help='Path to write results to as JSON')
+    parser.add_argument('--compare', type=str, default=None, help='Path to earlier JSON results to compare against')
+
+    return parser.parse_args()
+
+
+def generate_document(rng: random.Random, fields: int, width: int, depth: int) -> dict:
+    """Returns a document shaped like data/jon_snow.json, scaled by fields, width and depth."""
+    doc = {
+        'First': rng.choice(NAMES),
+        'Last': rng.choice(['Snow', 'Stark', 'Targaryen']),
+        'Age': rng.randint(1, 80),
+        'Titles': [rng.choice(TITLES) for _ in range(width)],
+        'Alive': rng.random() < 0.5,
+        'Companions': [
+            {
+                'Type': rng.choice(['Dire Wolf', 'Dragon', 'Human']),
+                'Name': rng.choice(NAMES),
+                'Alive': rng.random() < 0.5,
+                'AppearsIn': sorted(rng.sample(range(1, 9), rng.randint(1, 8))),
+            }
+            for _ in range(width)
+        ],
+    }
+
+    for i in range(fields):
+        doc[f'Field{i}'] = rng.choice([rng.randint(0, 1000), rng.random(), rng.choice(NAMES)])
+
+    nested = doc
+    for level in range(depth):
+        nested['Child'] = {'Level': level, 'Name': rng.choice(NAMES)}
+        nested = nested['Child']
+
+    return doc
+
+
+def generate_corpus(path: str, files: int, fields: int, width: int, depth: int, seed: int):
+    rng = random.Random(seed)
+    os.makedirs(path, exist_ok=True)
+
+    for i in range(files):
+        with open(os.path.join(path, f'doc{i:06}.json'), 'w') as fout:
+            json.dump(generate_document(rng, fields, width, depth), fout, indent=4)
+
+
+def deep_path(depth: int, leaf: str) -> str:
+    return ''.join(['.Child'] * depth) + f'.{leaf}'
+
+
+def expressions(depth: int) -> dict:
+    return {
+        'simple': ['-eq', '.First', 'Jon'],
+        'array': ['-gt', '.Companions[].AppearsIn[]', '7'],
+        'all': ['-EQ', '.Companions[].Type', 'Dire Wolf'],
+        'compound': ['-and', '-or', '-eq', '.Last', 'Snow', '-in', 'Crow', '.Titles', '-ge', '.Age', '18'],
+        'regex': ['-mt', '.Titles[]', 'King'],
+        'deep': ['-eq', deep_path(depth, 'Name'), 'Ghost'],
+    }
+
+
+def best_of(repeat: int, func) -> float:
+    """Returns the fastest of repeat runs of func, in seconds."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best
+
+
+def bench_create_tree(args, exprs: dict) -> dict:
+    loops = 2000
+
+    def run(tokens):
+        for _ in range(loops):
+            create_tree(Queue(list(tokens)))
+
+    return {name: (best_of(args.repeat, lambda: run(tokens)), loops) for name, tokens in exprs.items()}
+
+
+def bench_get_value(args, docs: list) -> dict:
+    paths = {
+        'key': '.First',
+        'index': '.Titles[0]',
+        'wildcard': '.Companions[].Name',
+        'nested_wildcard': '.Companions[].AppearsIn[]',
+        'deep': deep_path(args.depth, 'Name'),
+    }
+
+    def run(prop_path):
+        for doc in docs:
+            get_value(doc, prop_path)
+
+    return {name: (best_of(args.repeat, lambda: run(PropertyPath(path))), len(docs)) for name, path in paths.items()}
+
+
+def bench_evaluators(args) -> dict:
+    rng = random.Random(args.seed)
+    many_a = [rng.randint(0, 100) for _ in range(args.width)]
+    many_b = [rng.randint(0, 100) for _ in range(args.width)]
+    loops = 20000
+
+    never = lambda a, b: False
+    always = lambda a, b: True
+    cases = {
+        'some_many_to_one': lambda: Some.evaluate(never, many_a, 101),
+        'some_many_to_many': lambda: Some.evaluate(never, many_a, many_b),
+        'all_many_to_one': lambda: All.evaluate(always, many_a, 101),
+        'all_many_to_many': lambda: All.evaluate(always, many_a, many_b),
+    }
+
+    def run(case):
+        for _ in range(loops):
+            case()
+
+    return {name: (best_of(args.repeat, lambda: run(case)), loops) for name, case in cases.items()}
+
+
+def bench_comparers(args) -> dict:
+    rng = random.Random(args.seed)
+    pairs = [(rng.choice(NAMES), rng.choice(NAMES)) for _ in range(1000)]
+    pairs += [(rng.randint(0, 100), rng.randint(0, 100)) for _ in range(1000)]
+
+    def run(callback):
+        for a, b in pairs:
+            try:
+                callback(a, b)
+            except TypeError:
+                pass
+
+    modes = {
+        'default': Comparisons(False, False),
+        'insensitive': Comparisons(True, False),
+        'string': Comparisons(False, True),
+        'insensitive_string': Comparisons(True, True),
+    }
+
+    return {name: (best_of(args.repeat, lambda: run(comparisons.callback('-eq'))), len(pairs)) for name, comparisons in modes.items()}
+
+
+def bench_predicates(args, exprs: dict, docs: list) -> dict:
+    def run(query):
+        for doc in docs:
+            query.predicate(doc)
+
+    queries = {name: jql.compile_query(tokens) for name, tokens in exprs.items()}
+
+    return {name: (best_of(args.repeat, lambda: run(query)), len(docs)) for name, query in queries.items()}
+
+
+def bench_columns(args, exprs: dict, docs: list) -> dict:
+    queries = {name: jql.compile_query(tokens) for name, tokens in exprs.items()}
+
+    # Columns are extracted once, as for a session of queries over the same files
+    paths = {}
+    for query in queries.values():
+        paths.update(query.paths)
+
+    columns = ColumnStore(range(len(docs)), docs.__getitem__)
+    columns.add(list(paths), (jql.extract_file_values(doc, paths) for doc in docs))
+
+    return {name: (best_of(args.repeat, lambda: query.evaluate_columns(columns)), len(docs)) for name, query in queries.items()}
+
+
+def run_main(argv: list):
+    saved = sys.argv
+    sys.argv = ['jql.py'] + argv
+
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            jql.main()
+    finally:
+        sys.argv = saved
+
+
+def bench_main(args, exprs: dict, corpus: str) -> dict:
+    cases = {
+        'simple': ['-eq', '.First', 'Jon'],
+        'simple_insensitive': ['--insensitive', '-eq', '.First', 'jon'],
+        'simple_string': ['--string', '-eq', '.Age', '18'],
+        'compound': exprs['compound'],
+        'deep': exprs['deep'],
+    }
+
+    return {name: (best_of(args.repeat, lambda: run_main([corpus] + tokens)), args.files) for name, tokens in cases.items()}
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results: dict, baseline: dict = None):
+    for stage, cases in results['stages'].items():
+        print(f"{stage}:")
+
+        for name, case in cases.items():
+            line = f"  {name:<24} {case['seconds'] * 1000:10.2f} ms  {case['per_op_us']:10.2f} us/op"
+
+            old = (baseline or {}).get('stages', {}).get(stage, {}).get(name)
+            if old is not None and old['per_op_us']:
+                line += f"  {case['per_op_us'] / old['per_op_us']:6.2f}x"
+
+            print(line)
+
+
+def main():
+    args = get_args()
+
+    # Evaluation logs nothing below CRITICAL by default, keep it that way here
+    jql.set_logging_level(0)
+
+    corpus = args.corpus or tempfile.mkdtemp(prefix='jql-bench-')
+
+    try:
+        generate_corpus(corpus, args.files, args.fields, args.width, args.depth, args.seed)
+        docs = [jql.get_json(os.path.join(corpus, f)) for f in sorted(os.listdir(corpus))]
+
+        exprs = expressions(args.depth)
+
+        stages = {
+            'create_tree': bench_create_tree(args, exprs),
+            'get_value': bench_get_value(args, docs),
+            'evaluators': bench_evaluators(args),
+            'comparers': bench_comparers(args),
+            'predicate': bench_predicates(args, exprs, docs),
+            'columns': bench_columns(args, exprs, docs),
+            'main': bench_main(args, exprs, corpus),
+        }
+
+    finally:
+        if args.corpus is None:
+            shutil.rmtree(corpus, ignore_errors=True)
+
+    results = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {key: getattr(args, key) for key in ('files', 'fields', 'width', 'depth', 'seed', 'repeat')},
+        'stages': {
+            stage: {
+                name: {'seconds': seconds, 'ops': ops, 'per_op_us': seconds / ops * 1e6}
+                for name, (seconds, ops) in cases.items()
+            }
+            for stage, cases in stages.items()
+        },
+    }
+
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare) as fin:
+            baseline = json.load(fin)
+
+        if baseline.get('parameters') != results['parameters']:
+            print(f"Warning: comparing against results with different parameters {baseline.get('parameters')}")
+
+    print_results(results, baseline)
+
+    if args.output is not None:
+        with open(args.output, 'w') as fout:
+            json.dump(results, fout, indent=4)
+
+
+if __name__ == '__main__':
+    main()
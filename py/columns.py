@@ -0,0 +1,162 @@
+import copy
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class ColumnStore:
+    """The values of property-paths across a list of files, one column per path, extracted once."""
+
+    def __init__(self, files=(), load=None, stamps=None):
+        self.files = list(files)
+        self.load = load
+
+        # Rows and columns are replaced rather than modified in place, so snapshots stay consistent
+        self.columns = {}
+        self.loaded = False
+
+        # (mtime_ns, size) of each row's file when it was read, for sync()
+        self.stamps = list(stamps) if stamps is not None else [None] * len(self.files)
+
+        # {file: stamp} of files that are not valid JSON
+        self.invalid = {}
+
+        # {path: {row: exception}} for paths that could not be resolved in some files
+        self._errors = {}
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    def snapshot(self) -> 'ColumnStore':
+        """A copy that shares the current rows and columns, unaffected by later updates."""
+        snapshot = copy.copy(self)
+        snapshot.columns = dict(self.columns)
+        snapshot.invalid = dict(self.invalid)
+        snapshot._errors = dict(self._errors)
+
+        return snapshot
+
+    def missing(self, paths) -> list:
+        """The paths of those given without a column yet."""
+        return [path for path in paths if path not in self.columns]
+
+    @staticmethod
+    def _collect(paths: list, extracted, first_row=0) -> tuple:
+        """Splits extracted into ({path: values}, {path: {row: exception}}, [indexes of invalid files])."""
+        columns = {path: [] for path in paths}
+        errors = {path: {} for path in paths}
+        invalid = []
+
+        row = first_row
+        for i, values in enumerate(extracted):
+            if values is None:
+                invalid.append(i)
+                continue
+
+            for path in paths:
+                value = values[path]
+
+                if isinstance(value, Exception):
+                    errors[path][row] = value
+                    value = None
+
+                columns[path].append(value)
+
+            row += 1
+
+        return columns, errors, invalid
+
+    def add(self, paths: list, extracted):
+        """Adds a column for each of paths from extracted: {path: value or exception} per file, None if invalid."""
+        columns, errors, invalid = self._collect(paths, extracted)
+
+        if invalid:
+            self._drop(invalid, invalid=True)
+
+        self.columns.update(columns)
+        self._errors.update((path, errs) for path, errs in errors.items() if errs)
+        self.loaded = True
+
+    def append(self, files: list, stamps: list, extracted):
+        """Adds rows for files, with extracted yielding values for every existing column as for add()."""
+        paths = list(self.columns)
+        columns, errors, invalid = self._collect(paths, extracted, len(self.files))
+
+        skip = set(invalid)
+        for i in invalid:
+            logger.debug("'%s' is not valid JSON", files[i])
+            self.invalid[files[i]] = stamps[i]
+
+        self.files = self.files + [file for i, file in enumerate(files) if i not in skip]
+        self.stamps = self.stamps + [stamp for i, stamp in enumerate(stamps) if i not in skip]
+
+        for path in paths:
+            self.columns[path] = self.columns[path] + columns[path]
+
+            if errors[path]:
+                self._errors[path] = {**self._errors.get(path, {}), **errors[path]}
+
+    def sync(self, stamps: dict, extract) -> tuple:
+        """Brings the rows up to date with stamps, {file: (mtime_ns, size)}; returns (added, removed) counts."""
+        stale = [row for row, (file, stamp) in enumerate(zip(self.files, self.stamps)) if stamps.get(file) != stamp]
+
+        for file, stamp in list(self.invalid.items()):
+            if stamps.get(file) != stamp:
+                del self.invalid[file]
+
+        if stale:
+            self._drop(stale)
+
+        known = set(self.files)
+        known.update(self.invalid)
+
+        new = [file for file in stamps if file not in known]
+        if new:
+            self.append(new, [stamps[file] for file in new], extract(new, list(self.columns)))
+
+        self.loaded = True
+
+        return len(new), len(stale)
+
+    def _drop(self, rows: list, invalid=False):
+        """Removes rows (in order) from the files and every existing column, as not valid JSON if invalid."""
+        drop = set(rows)
+        if invalid:
+            for row in rows:
+                logger.debug("Dropping '%s' from columns", self.files[row])
+                self.invalid[self.files[row]] = self.stamps[row]
+
+        keep = [row for row in range(len(self.files)) if row not in drop]
+
+        self.files = [self.files[row] for row in keep]
+        self.stamps = [self.stamps[row] for row in keep]
+        for path, column in self.columns.items():
+            self.columns[path] = [column[row] for row in keep]
+
+        # Renumber the rows of unresolvable values
+        renumber = {old: new for new, old in enumerate(keep)}
+        for path, errors in self._errors.items():
+            self._errors[path] = {renumber[row]: e for row, e in errors.items() if row in renumber}
+
+    def errors(self, path: str) -> dict:
+        """Returns {row: exception} for the rows in which path could not be resolved."""
+        return self._errors.get(path, {})
+
+    def document(self, row: int):
+        return self.load(self.files[row])
+
+    def take(self, path: str, rows, strict=True) -> list:
+        """Returns the values of path for rows, raising the first row's resolving error if strict."""
+        column = self.columns[path]
+
+        errors = self._errors.get(path)
+        if errors and strict:
+            for row in rows:
+                if row in errors:
+                    raise errors[row]
+
+        if len(rows) == len(column):
+            return column
+
+        return [column[row] for row in rows]
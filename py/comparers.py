@@ -1,38 +1,96 @@
-class Comparer:
-    def compare(self, a, b) -> int:
-        if a < b:
-            return -1
-        elif a > b:
-            return 1
-        else:
-            return 0
+def _is_fast(a, b) -> bool:
+    """Whether a and b are both str or both int, for which the operators below equal the three-way results."""
+    t = type(a)
+    return t is type(b) and (t is str or t is int)
+
+
+# Each test gives the same result (or raises the same TypeError) as a
+# three-way comparison (-1 if a < b, 1 if a > b, else 0) checked against 0,
+# with a fast path for operands whose ordering is total
+def _eq(a, b):
+    if _is_fast(a, b):
+        return a == b
+    return not a < b and not a > b
+
+
+def _ne(a, b):
+    if _is_fast(a, b):
+        return a != b
+    return a < b or a > b
+
+
+def _lt(a, b):
+    return a < b
+
+
+def _le(a, b):
+    if _is_fast(a, b):
+        return a <= b
+    return a < b or not a > b
+
 
+def _gt(a, b):
+    if _is_fast(a, b):
+        return a > b
+    return not a < b and a > b
 
-class _ComparerDecorator(Comparer):
-    def __init__(self, base: Comparer):
-        self._base = base
 
-    @property
-    def base(self) -> Comparer:
-        return self._base
+def _ge(a, b):
+    return not a < b
 
-    def compare(self, a, b):
-        return self._base.compare(a, b)
 
+COMPARISON_TESTS = {
+    '-eq': _eq,
+    '-ne': _ne,
+    '-lt': _lt,
+    '-le': _le,
+    '-gt': _gt,
+    '-ge': _ge,
+}
 
-class InsensitiveComparer(_ComparerDecorator):
-    def compare(self, a, b) -> int:
-        if isinstance(a, str):
-            a = a.lower()
-        if isinstance(b, str):
-            b = b.lower()
 
-        return self.base.compare(a, b)
+def _casefold(value):
+    return value.casefold() if isinstance(value, str) else value
+
+
+def _casefold_string(value):
+    return str(value).casefold()
+
+
+class Comparisons:
+    """
+    Comparison callbacks for one combination of --insensitive and --string.
+
+    The normalization (str() and/or casefold) is chosen once, and callbacks
+    can skip it for an operand that was normalized in advance with normalize().
+    """
+
+    def __init__(self, insensitive=False, force_string=False):
+        self.insensitive = insensitive
+        self.force_string = force_string
+
+        if insensitive and force_string:
+            self.normalize = _casefold_string
+        elif force_string:
+            self.normalize = str
+        elif insensitive:
+            self.normalize = _casefold
+        else:
+            self.normalize = None
+
+    def callback(self, lop: str, normalized_a=False, normalized_b=False):
+        """Returns the callback for a comparison operator, or None if lop is not one."""
+        test = COMPARISON_TESTS.get(lop)
+        normalize = self.normalize
 
+        if test is None or normalize is None:
+            return test
 
-class ForceStringComparer(_ComparerDecorator):
-    def compare(self, a, b):
-        a = str(a)
-        b = str(b)
+        if normalized_a and normalized_b:
+            return test
+        if normalized_b:
+            return lambda a, b: test(normalize(a), b)
+        if normalized_a:
+            return lambda a, b: test(a, normalize(b))
 
-        return self.base.compare(a, b)
+        return lambda a, b: test(normalize(a), normalize(b))
@@ -0,0 +1,118 @@
+import os
+import re
+import fnmatch
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class PathFilter:
+    """
+    Matches files and directories against include/exclude glob patterns.
+
+    Patterns without a '/' match against the base name, others against the
+    path relative to the search root (with '/' separators). Matching follows
+    the platform's case sensitivity, like fnmatch.
+    """
+
+    def __init__(self, include=None, exclude=None):
+        self.include = include
+        self.exclude = exclude
+
+        self._include_name, self._include_path = self._compile(include or [])
+        self._exclude_name, self._exclude_path = self._compile(exclude or [])
+
+    def __repr__(self) -> str:
+        return f"PathFilter(include={self.include!r}, exclude={self.exclude!r})"
+
+    @staticmethod
+    def _compile(patterns):
+        """Returns (name regex, relative path regex); either is None if no pattern applies to it."""
+        def join(group):
+            if not group:
+                return None
+            return re.compile('|'.join(fnmatch.translate(os.path.normcase(p)) for p in group))
+
+        return join([p for p in patterns if '/' not in p]), join([p for p in patterns if '/' in p])
+
+    @staticmethod
+    def _matches(name_regex, path_regex, name: str, rel_path: str) -> bool:
+        if name_regex is not None and name_regex.match(os.path.normcase(name)):
+            return True
+
+        return path_regex is not None and path_regex.match(os.path.normcase(rel_path)) is not None
+
+    def excludes(self, name: str, rel_path: str) -> bool:
+        return self._matches(self._exclude_name, self._exclude_path, name, rel_path)
+
+    def accepts(self, name: str, rel_path: str) -> bool:
+        if self.excludes(name, rel_path):
+            return False
+
+        if self.include is None:
+            return True
+
+        return self._matches(self._include_name, self._include_path, name, rel_path)
+
+
+def walk_files(root: str, path_filter: PathFilter, max_depth=None):
+    """Yields the paths of the files walk_entries() finds."""
+    for entry in walk_entries(root, path_filter, max_depth):
+        yield entry.path
+
+
+def walk_entries(root: str, path_filter: PathFilter, max_depth=None):
+    """
+    Yields the os.DirEntry of each file under root that path_filter accepts, up to max_depth levels below it.
+
+    Excluded directories are pruned without being listed. As with os.walk,
+    symlinked directories are not followed and unreadable directories are skipped.
+    """
+    # (directory, relative path, depth)
+    pending = [(root, '', 0)]
+
+    while pending:
+        dir_path, rel_dir, depth = pending.pop()
+
+        try:
+            entries = list(os.scandir(dir_path))
+        except OSError as e:
+            logger.warning("Could not list '%s': %s", dir_path, e)
+            continue
+
+        subdirs = []
+        for entry in entries:
+            rel_path = f'{rel_dir}/{entry.name}' if rel_dir else entry.name
+
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+
+            if is_dir:
+                if (max_depth is None or depth < max_depth) and not entry.is_symlink() \
+                        and not path_filter.excludes(entry.name, rel_path):
+                    subdirs.append((entry.path, rel_path, depth + 1))
+                continue
+
+            if path_filter.accepts(entry.name, rel_path):
+                logger.debug("Found '%s'", entry.path)
+                yield entry
+
+            else:
+                logger.debug("Skipping '%s'", entry.path)
+
+        # Visit subdirectories in listing order
+        pending.extend(reversed(subdirs))
+
+
+def read_file_list(fin, base: str, path_filter: PathFilter):
+    """Yields the paths listed one per line in fin that path_filter accepts, relative paths resolved against base."""
+    for line in fin:
+        path = line.rstrip('\r\n')
+        if not path:
+            continue
+
+        if path_filter.accepts(os.path.basename(path), path.replace(os.sep, '/')):
+            yield os.path.join(base, path)
@@ -0,0 +1,286 @@
+import os
+import re
+import math
+import sqlite3
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    valid INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS indexed_paths (
+    prop_path TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS file_paths (
+    prop_path TEXT NOT NULL,
+    file_id INTEGER NOT NULL,
+    family TEXT NOT NULL,
+    members_clean INTEGER NOT NULL,
+    PRIMARY KEY (prop_path, file_id)
+);
+CREATE TABLE IF NOT EXISTS postings (
+    prop_path TEXT NOT NULL,
+    kind INTEGER NOT NULL,
+    value,
+    file_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS postings_lookup ON postings (prop_path, kind, value);
+'''
+
+# Posting kinds: an element of a path's value, or a member of such an element
+# (an item of an array element or a key of an object element)
+ELEMENT = 0
+MEMBER = 1
+
+# Element families of a path's value. Comparing a literal against a value of the
+# wrong family raises TypeError, which makes the whole comparison false.
+EMPTY = ''
+STRINGS = 'str'
+NUMBERS = 'num'
+MIXED = 'mixed'
+
+# Larger integers may not compare exactly against floats in SQLite
+INT_LIMIT = 2 ** 53
+
+KEY_REGEX = re.compile(r'^[A-Za-z0-9]+$')
+
+
+def storable(value) -> bool:
+    """Whether value compares in SQLite exactly as it does in Python."""
+    if isinstance(value, str):
+        try:
+            value.encode('utf-8')
+        except UnicodeEncodeError:
+            return False
+        return True
+
+    if isinstance(value, bool):
+        return True
+
+    if isinstance(value, int):
+        return -INT_LIMIT <= value <= INT_LIMIT
+
+    if isinstance(value, float):
+        return not math.isnan(value)
+
+    return False
+
+
+def family_of(elements: list) -> str:
+    if not elements:
+        return EMPTY
+
+    if all(isinstance(el, str) and storable(el) for el in elements):
+        return STRINGS
+
+    if all(isinstance(el, (int, float)) and storable(el) for el in elements):
+        return NUMBERS
+
+    return MIXED
+
+
+def members_of(elements: list):
+    """Returns the scalar members of array/object elements, or None if -in cannot be answered from them."""
+    members = set()
+
+    for el in elements:
+        if isinstance(el, dict):
+            if not all(storable(key) for key in el):
+                return None
+            members.update(el)
+
+        elif isinstance(el, list):
+            for member in el:
+                if isinstance(member, (dict, list)):
+                    continue
+                if not storable(member):
+                    return None
+                members.add(member)
+
+        else:
+            return None
+
+    return members
+
+
+def leaf_paths(json, prefix=''):
+    """
+    Yields the property-path of every leaf in json, with [] for every array.
+
+    Paths to arrays themselves are included too, so -in can be answered for them.
+    """
+    if isinstance(json, dict):
+        for key, value in json.items():
+            if KEY_REGEX.match(key):
+                yield from leaf_paths(value, f'{prefix}.{key}')
+
+    elif isinstance(json, list):
+        if prefix:
+            yield prefix
+
+            for el in json:
+                yield from leaf_paths(el, f'{prefix}[]')
+
+    elif prefix:
+        yield prefix
+
+
+class InvertedIndex:
+    """
+    On-disk inverted index from (property-path, value) to files.
+
+    For every indexed file and path it records whether the path exists, the
+    family of its elements, and postings for its elements and their members.
+    """
+
+    def __init__(self, db_path: str):
+        self._conn = sqlite3.connect(db_path)
+        self._conn.executescript(SCHEMA)
+
+    def close(self):
+        self._conn.commit()
+        self._conn.close()
+
+    def clear(self, prop_paths):
+        for table in ('files', 'indexed_paths', 'file_paths', 'postings'):
+            self._conn.execute(f'DELETE FROM {table}')
+
+        self._conn.executemany('INSERT INTO indexed_paths (prop_path) VALUES (?)', [(p,) for p in prop_paths])
+
+    def add_file(self, path: str, stat: os.stat_result, values: dict):
+        """Indexes values (property-path to get_value() result) for path; values=None marks it as invalid JSON."""
+        cursor = self._conn.execute(
+            'INSERT INTO files (path, mtime_ns, size, valid) VALUES (?, ?, ?, ?)',
+            (os.path.abspath(path), stat.st_mtime_ns, stat.st_size, values is not None))
+        file_id = cursor.lastrowid
+
+        for prop_path, elements in (values or {}).items():
+            if elements is None:
+                continue
+
+            members = members_of(elements)
+
+            self._conn.execute(
+                'INSERT INTO file_paths (prop_path, file_id, family, members_clean) VALUES (?, ?, ?, ?)',
+                (prop_path, file_id, family_of(elements), members is not None))
+
+            postings = {(ELEMENT, el) for el in elements if storable(el)}
+            postings.update((MEMBER, member) for member in members or ())
+
+            self._conn.executemany(
+                'INSERT INTO postings (prop_path, kind, value, file_id) VALUES (?, ?, ?, ?)',
+                [(prop_path, kind, value, file_id) for kind, value in postings])
+
+    def files(self) -> dict:
+        """Returns {absolute path: (id, mtime_ns, size, valid)} for every indexed file."""
+        rows = self._conn.execute('SELECT path, id, mtime_ns, size, valid FROM files')
+        return {row[0]: row[1:] for row in rows}
+
+    def paths(self) -> set:
+        return {row[0] for row in self._conn.execute('SELECT prop_path FROM indexed_paths')}
+
+    def _ids(self, query: str, *params) -> set:
+        return {row[0] for row in self._conn.execute(query, params)}
+
+    def answer(self, tree, is_path, insensitive=False, force_string=False):
+        """
+        Evaluates tree from the index alone.
+
+        Returns (true_ids, unknown_ids): the files the tree is known to match,
+        and the files that still need a full evaluation. Every other indexed
+        valid file is known not to match.
+        """
+        all_ids = self._ids('SELECT id FROM files WHERE valid')
+        indexed = self.paths()
+
+        def unknown():
+            return set(), all_ids
+
+        def literal_and_path(operands):
+            a, b = operands
+            if is_path(b) and not is_path(a):
+                return a, b
+            if is_path(a) and not is_path(b):
+                return b, a
+            return None, None
+
+        def visit(tree):
+            if not isinstance(tree, dict):
+                return unknown()
+
+            for op, operands in tree.items():
+                lop = op.lower()
+
+                if lop in ('-and', '-or', '-not'):
+                    if not all(isinstance(operand, dict) for operand in operands):
+                        return unknown()
+
+                    answers = [visit(operand) for operand in operands]
+
+                    if lop == '-not':
+                        true, maybe = answers[0]
+                        return all_ids - true - maybe, maybe
+
+                    (true_a, maybe_a), (true_b, maybe_b) = answers
+
+                    if lop == '-and':
+                        true = true_a & true_b
+                        return true, ((true_a | maybe_a) & (true_b | maybe_b)) - true
+
+                    true = true_a | true_b
+                    return true, (maybe_a | maybe_b) - true
+
+                if lop == '-ex' or lop == '-nex':
+                    path = operands[0]
+                    if not is_path(path) or path not in indexed:
+                        return unknown()
+
+                    existing = self._ids('SELECT file_id FROM file_paths WHERE prop_path = ?', path)
+                    return (existing if lop == '-ex' else all_ids - existing), set()
+
+                # Capitalized operators are left to full evaluation
+                if not op.islower():
+                    return unknown()
+
+                if lop == '-eq':
+                    if insensitive or force_string:
+                        return unknown()
+
+                    literal, path = literal_and_path(operands)
+                    if path not in indexed or not storable(literal):
+                        return unknown()
+
+                    maybe = self._ids(
+                        'SELECT file_id FROM file_paths WHERE prop_path = ? AND family = ?', path, MIXED)
+                    true = self._ids(
+                        'SELECT file_id FROM postings WHERE prop_path = ? AND kind = ? AND value = ?',
+                        path, ELEMENT, literal)
+                    return true - maybe, maybe
+
+                if lop == '-in':
+                    literal, path = operands
+                    if not is_path(path) or path not in indexed or is_path(literal) or not storable(literal):
+                        return unknown()
+
+                    maybe = self._ids(
+                        'SELECT file_id FROM file_paths WHERE prop_path = ? AND NOT members_clean', path)
+                    true = self._ids(
+                        'SELECT file_id FROM postings WHERE prop_path = ? AND kind = ? AND value = ?',
+                        path, MEMBER, literal)
+                    return true - maybe, maybe
+
+                return unknown()
+
+            return unknown()
+
+        true, maybe = visit(tree)
+        logger.info('Index answered %d of %d files (%d to evaluate)', len(all_ids) - len(maybe), len(all_ids), len(maybe))
+        return true, maybe
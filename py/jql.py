@@ -1,16 +1,42 @@
 import re
 import os
 import sys
+import copy
+import mmap
+import time
 import json
+import codecs
+import locale
+import contextlib
+import functools
+import itertools
 import shlex
+import signal
 import logging
 import argparse
+import threading
+import multiprocessing
+import multiprocessing.util
 from evaluators import SomeEvaluator as Some
 from evaluators import AllEvaluator as All
 from comparers import *
+from prefilter import build_prefilter, Rejected
+from pathcache import PathCache, InvalidFile
+from index import InvertedIndex, leaf_paths
+from jsonarray import ArrayReader
+from discovery import PathFilter, walk_files, walk_entries, read_file_list
+from stats import Stats
+from vectorized import compile_vector_test
+from columns import ColumnStore
+from server import BadRequest, QueryServer, UnixQueryServer
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-logging.basicConfig()
+
+logger = logging.getLogger(__name__)
 
 
 class Queue:
@@ -26,6 +52,9 @@ class Queue:
     def peek(self) -> str:
         return self._items[0]
 
+    def __len__(self) -> int:
+        return len(self._items)
+
 
 class InvalidPathOrExpression(Exception):
     def __init__(self, *args):
@@ -37,43 +66,155 @@ class InvalidPathOrExpression(Exception):
         super().__init__(msg)
 
 
-comparer = Comparer()
+def add_discovery_args(parser: argparse.ArgumentParser):
+    parser.add_argument('--recurse', action='store_true', help='Recursively search for files')
+    parser.add_argument('--max-depth', type=int, default=None, help='With --recurse, how many directory levels below root to search (default: no limit)')
+    parser.add_argument('--include', action='append', default=None, help="Glob of files to search, may be repeated (default: '*.json', or '*.jsonl', '*.ndjson' and '*.json' with --lines)")
+    parser.add_argument('--exclude', action='append', default=None, help='Glob of files or directories to skip, may be repeated')
+    parser.add_argument('--files-from', type=str, default=None, help="Read the files to search from this file ('-' for stdin), one per line, relative to root")
 
 
 def get_args():
     parser = argparse.ArgumentParser()
 
-    parser.add_argument('root', type=str, help='Path to root to search for .json files')
-    parser.add_argument('--recurse', action='store_true', help='Recursively search for files')
+    parser.add_argument('root', type=str, help="Path to root to search for .json files ('-' for stdin with --lines or --elements)")
+    add_discovery_args(parser)
     parser.add_argument('--insensitive', action='store_true', help='Compare strings as case-insensitive (does not affect JSON paths)')
     parser.add_argument('--string', dest='force_string', action='store_true', help='Compare all values as strings')
     parser.add_argument('--list', action='store_true', help='Skip all meta output and only list files')
+    parser.add_argument('--unsorted', action='store_true', help='Print matching files as they are found instead of sorting them at the end')
+    parser.add_argument('--no-prefilter', dest='prefilter', action='store_false', help='Decode every file instead of first rejecting files whose raw bytes cannot match')
+    parser.add_argument('--cache', type=str, default=None, help='Path to a cache of extracted values, reused while files are unchanged')
+    parser.add_argument('--index', type=str, default=None, help="Path to an index built by 'jql.py index', used to answer the expression where possible")
+    parser.add_argument('--batch', type=str, default=None, help="Path to a file of 'name: expression' lines, all evaluated in one pass")
+    parser.add_argument('--lines', action='store_true', help='Treat files as JSON Lines and evaluate each record, printing <file>:<line> for matches')
+    parser.add_argument('--elements', action='store_true', help='Treat files as one top-level array and evaluate each element as it is read, printing <file>[<index>] for matches')
+    parser.add_argument('--records', action='store_true', help='With --lines or --elements, print matching records instead of their positions')
+    parser.add_argument('--jobs', type=int, default=1, help='Number of worker processes to evaluate files with (0 = one per CPU, default: 1)')
+    parser.add_argument('--columnar', action='store_true', help='Extract the paths the expression uses from every file first, then evaluate it a column at a time (shared by all expressions with --batch)')
+    parser.add_argument('--watch', action='store_true', help="Keep polling for added, changed and removed files, printing '+ <file>'/'- <file>' as files start or stop matching")
+    parser.add_argument('--interval', type=float, default=2.0, help='Seconds between polls with --watch (default: 2)')
+    parser.add_argument('--stats', action='store_true', help='Print timings and counters for the run to stderr')
+    parser.add_argument('--stats-format', choices=['text', 'json'], default='text', help='Format of --stats output (default: text)')
+    parser.add_argument('--slowest', type=int, default=10, help='Number of slowest files listed by --stats (default: 10)')
     parser.add_argument('-v', dest='verbosity', action='count', default=0, help='Increase level of logging (default: none)')
+    parser.add_argument('--trace', action='store_true', help='Log every node as it is evaluated against every document (implies -vv)')
 
     args, jql_tokens = parser.parse_known_args()
 
-    if len(jql_tokens) == 0:
+    if len(jql_tokens) == 0 and args.batch is None:
         raw_in = input("JQL expression> ")
         jql_tokens = shlex.split(raw_in)
 
+    if args.trace:
+        args.verbosity = max(args.verbosity, 2)
+
     set_logging_level(args.verbosity)
 
     return args, jql_tokens
 
 
-def get_json(path: str) -> dict:
-    logging.info("Loading '%s' as json", path)
-    try:
-        with open(path, 'r') as fin:
-            data = json.load(fin)
+def get_index_args():
+    parser = argparse.ArgumentParser(prog='jql.py index', description='Build an inverted index of property-path values')
+
+    parser.add_argument('root', type=str, help='Path to root to search for .json files')
+    parser.add_argument('index', type=str, help='Path to write the index to (replaced if it exists)')
+    parser.add_argument('--paths', nargs='+', default=None, help='Property-paths to index (default: every leaf path found)')
+    add_discovery_args(parser)
+    parser.add_argument('-v', dest='verbosity', action='count', default=0, help='Increase level of logging (default: none)')
+
+    args = parser.parse_args(sys.argv[2:])
+
+    set_logging_level(args.verbosity)
+
+    return args
+
+
+def get_serve_args():
+    parser = argparse.ArgumentParser(prog='jql.py serve', description="Answer expressions over files held in memory, POSTed as JSON to /query")
+
+    parser.add_argument('root', type=str, help='Path to root to search for .json files')
+    add_discovery_args(parser)
+    parser.add_argument('--port', type=int, default=8337, help='Port to listen on at 127.0.0.1 (default: 8337)')
+    parser.add_argument('--socket', type=str, default=None, help='Listen on this Unix socket instead of a port')
+    parser.add_argument('--paths', nargs='+', default=[], help='Property-paths to extract before serving (others are extracted when first queried)')
+    parser.add_argument('--jobs', type=int, default=1, help='Number of worker processes to decode files with (0 = one per CPU, default: 1)')
+    parser.add_argument('--interval', type=float, default=2.0, help='Seconds between checks for added, changed and removed files (default: 2)')
+    parser.add_argument('-v', dest='verbosity', action='count', default=0, help='Increase level of logging (default: none)')
+
+    args = parser.parse_args(sys.argv[2:])
+
+    set_logging_level(args.verbosity)
+
+    return args
+
+
+# Files at least this large are memory-mapped rather than read into memory
+MMAP_THRESHOLD = 16 * 1024 * 1024
+
+JSON_START_REGEX = re.compile(rb'(?:\xef\xbb\xbf)?\s*[\[{]')
+
+# orjson turns integers beyond 64 bits into floats, where json keeps them exact
+LONG_NUMBER_REGEX = re.compile(rb'\d{19}')
+
+
+@contextlib.contextmanager
+def read_file(path: str):
+    """Yields the contents of the file at path in one read, or memory-mapped if the file is large."""
+    logger.info("Reading '%s'", path)
+    with open(path, 'rb') as fin:
+        if os.fstat(fin.fileno()).st_size < MMAP_THRESHOLD:
+            yield fin.read()
+            return
+
+        with mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as raw:
+            yield raw
 
-    except UnicodeDecodeError:
-        logging.debug("Using cp1252 encoding for '%s'", path)
 
-        with open(path, 'r', encoding='cp1252') as fin:
-            data = json.load(fin)
+def looks_like_json(raw) -> bool:
+    return JSON_START_REGEX.match(raw) is not None
 
-    return data
+
+def sniff_encoding(head: bytes):
+    """Returns the encoding given away by a BOM or by null bytes (RFC 4627), else None."""
+    encoding = json.detect_encoding(head)
+    return None if encoding == 'utf-8' else encoding
+
+
+def decode_json(raw, path: str) -> dict:
+    """Decodes raw bytes (or a memory-mapped file) straight to JSON, without intermediate copies."""
+    encoding = sniff_encoding(raw[:4])
+
+    if encoding is None:
+        encoding = locale.getpreferredencoding(False)
+
+        if orjson is not None and codecs.lookup(encoding).name == 'utf-8' and not LONG_NUMBER_REGEX.search(raw):
+            try:
+                with memoryview(raw) as view:
+                    return orjson.loads(view)
+            except orjson.JSONDecodeError:
+                # Not UTF-8, or only accepted by the json module (e.g. NaN or huge integers)
+                pass
+
+        try:
+            text = str(raw, encoding)
+
+        except UnicodeDecodeError:
+            # Decoding stops at the first invalid byte, so this costs less than a full pass
+            logger.debug("Using cp1252 encoding for '%s'", path)
+            text = str(raw, 'cp1252')
+
+    else:
+        logger.debug("Using %s encoding for '%s'", encoding, path)
+        text = str(raw, encoding)
+
+    return json.loads(text)
+
+
+def get_json(path: str) -> dict:
+    logger.info("Loading '%s' as json", path)
+    with read_file(path) as raw:
+        return decode_json(raw, path)
 
 
 # (operator, # of params)
@@ -107,8 +248,11 @@ ALL_OPS = set(map(lambda t: t[0], OPS))
 BACKREF_REGEX = re.compile(r'\$(?P<refid>\d+)')
 
 
-def create_tree(tokens: Queue, force_string=False, leaves=[]) -> dict:
-    logging.debug("Creating expression tree from '%s'...", tokens.peek())
+def create_tree(tokens: Queue, force_string=False, leaves=None) -> dict:
+    if leaves is None:
+        leaves = []
+
+    logger.debug("Creating expression tree from '%s'...", tokens.peek())
 
     # Key = op
     # Value = dict/tuple
@@ -117,7 +261,7 @@ def create_tree(tokens: Queue, force_string=False, leaves=[]) -> dict:
     if curr.lower() not in ALL_OPS:
         try:
             val = int(curr)
-            logging.debug("Parsing '%s' as int", curr)
+            logger.debug("Parsing '%s' as int", curr)
             leaves.append(val)
             return val
         except ValueError:
@@ -125,20 +269,20 @@ def create_tree(tokens: Queue, force_string=False, leaves=[]) -> dict:
 
         try:
             val = float(curr)
-            logging.debug("Parsing '%s' as float", curr)
+            logger.debug("Parsing '%s' as float", curr)
             leaves.append(val)
             return val
         except ValueError:
             pass
 
         if curr.lower() == 'true':
-            logging.debug("Parsing '%s' as True bool", curr)
+            logger.debug("Parsing '%s' as True bool", curr)
             val = True
             leaves.append(val)
             return val
 
         if curr.lower() == 'false':
-            logging.debug("Parsing '%s' as False bool", curr)
+            logger.debug("Parsing '%s' as False bool", curr)
             val = False
             leaves.append(val)
             return val
@@ -146,21 +290,21 @@ def create_tree(tokens: Queue, force_string=False, leaves=[]) -> dict:
         if m := BACKREF_REGEX.match(curr):
             idx = int(m['refid'])
             if idx <= len(leaves):
-                logging.debug("Parsing '%s' as back-reference", curr)
+                logger.debug("Parsing '%s' as back-reference", curr)
                 return leaves[idx - 1]
 
-        logging.debug("Parsing '%s' as bare string", curr)
+        logger.debug("Parsing '%s' as bare string", curr)
 
         leaves.append(curr)
         return curr
 
-    logging.debug("Parsing '%s' as operator...", curr)
+    logger.debug("Parsing '%s' as operator...", curr)
 
     for op, num_args in OPS:
         if curr.lower() == op:
-            logging.debug(curr)
+            logger.debug(curr)
             retv = {}
-            args = tuple( create_tree(tokens, leaves) for _ in range(num_args) )
+            args = tuple( create_tree(tokens, force_string, leaves) for _ in range(num_args) )
             retv[curr] = args
 
             return retv
@@ -169,237 +313,737 @@ def create_tree(tokens: Queue, force_string=False, leaves=[]) -> dict:
 
 
 ARRAY_PATH_REGEX = re.compile(r'^(?P<path>[A-Za-z0-9]+)\[(?P<idx>\d+)?\]$')
-def get_value(json: dict, prop_path: str):
-    logging.debug("Getting value of '%s'", prop_path)
+PATH_REGEX = re.compile(r'^(\.[A-Za-z0-9]+(\[\d*\])?)+$')
+
+
+def is_path(operand) -> bool:
+    return isinstance(operand, str) and PATH_REGEX.search(operand) is not None
+
+
+class PropertyPath:
+    """A property-path compiled into (kind, key, idx) steps: KEY, INDEX or WILDCARD."""
+
+    KEY = 0
+    INDEX = 1
+    WILDCARD = 2
+
+    def __init__(self, prop_path: str):
+        self.path = prop_path
+
+        steps = []
+        for path_el in prop_path.split('.')[1:]:
+            m = ARRAY_PATH_REGEX.match(path_el)
+
+            if m is None:
+                steps.append((PropertyPath.KEY, path_el, None))
+            elif m['idx'] is None:
+                steps.append((PropertyPath.WILDCARD, m['path'], None))
+            else:
+                steps.append((PropertyPath.INDEX, m['path'], int(m['idx'])))
+
+        self.steps = tuple(steps)
+
+        # Paths made only of property names resolve to at most one value
+        if all(kind == PropertyPath.KEY for kind, _, _ in steps):
+            self.keys = tuple(key for _, key, _ in steps)
+        else:
+            self.keys = None
+
+    def __repr__(self) -> str:
+        return self.path
+
+
+def get_value(json: dict, prop_path: PropertyPath):
+    if prop_path.keys is not None:
+        el = json
+        for key in prop_path.keys:
+            if el is None:
+                return []
+
+            if key not in el:
+                return None
+
+            el = el[key]
+
+        return [el]
 
     curr = [json]
-    for path_el in prop_path.split('.')[1:]:
+    for kind, key, idx in prop_path.steps:
         new_curr = []
 
         for el in curr:
             if el is None:
                 continue
 
-            elif m := ARRAY_PATH_REGEX.match(path_el):
-                path = m['path']
-                idx = m['idx']
-
-                if path not in el:
-                    logging.debug("Path '%s' not found - returning no value", path)
-                    return None
-
-                elif idx is None:
-                    new_curr += el[path]
+            if key not in el:
+                return None
 
-                else:
-                    idx = int(idx)
+            if kind == PropertyPath.KEY:
+                new_curr.append(el[key])
 
-                    if len(el[path]) <= idx:
-                        logging.debug("Index '%d' out of range (len=%d) - returning no value", idx, len(el[path]))
-                        return None
-                    else:
-                        new_curr.append(el[path][idx])
+            elif kind == PropertyPath.WILDCARD:
+                new_curr += el[key]
 
-            elif path_el not in el:
-                logging.debug("Path '%s' not found - returning no value", path_el)
+            elif len(el[key]) <= idx:
                 return None
 
             else:
-                new_curr.append(el[path_el])
+                new_curr.append(el[key][idx])
 
         curr = new_curr
 
-    if isinstance(curr, str):
-        curr = curr
+    return curr
 
-    if isinstance(curr, list):
-        curr = [evaluate(json, el) for el in curr]
 
-    logging.debug(curr)
-    return curr
+# Callbacks handed to the Some/All evaluators, keyed by lower-cased operator
+UNARY_CALLBACKS = {
+    '-not': lambda p: not p,
+    '-len': len,
+    '-obj': lambda p: isinstance(p, dict),
+    '-arr': lambda p: isinstance(p, list),
+    '-str': lambda p: isinstance(p, str),
+    '-num': lambda p: isinstance(p, int) or isinstance(p, float),
+    '-bool': lambda p: isinstance(p, bool),
+}
+BINARY_CALLBACKS = {
+    '-and': lambda a, b: a and b,
+    '-or': lambda a, b: a or b,
+    '-in': lambda a, b: a in b,
+    '-nin': lambda a, b: a not in b,
+    '-mt': lambda a, b: compile_pattern(b).search(a) is not None,
+    '-rx': lambda a, b: compile_pattern(b).search(a) is not None,
+}
 
 
-PATH_REGEX = re.compile(r'^(\.[A-Za-z0-9]+(\[\d*\])?)+$')
-def evaluate(json: dict, operator):
-    global comparer
+# Patterns only known at evaluation time (paths or expressions) are compiled
+# through a bounded cache; literal patterns are compiled once in compile_literal_regex()
+PATTERN_CACHE_SIZE = 512
+
+
+@functools.lru_cache(maxsize=PATTERN_CACHE_SIZE)
+def compile_pattern(pattern):
+    return re.compile(pattern)
+
+
+def get_stored_value(values: dict, prop_path: PropertyPath):
+    """Resolver for predicates evaluated against pre-extracted values keyed by property-path."""
+    return values[prop_path.path]
+
+
+class PathValues(dict):
+    """The values of property-paths in one document, each resolved on first use."""
+
+    def __init__(self, json, paths: dict):
+        super().__init__()
+        self._json = json
+        self._paths = paths
+
+    def __missing__(self, path: str):
+        value = self[path] = get_value(self._json, self._paths[path])
+        return value
+
+
+def tree_key(tree):
+    """A hashable key identifying equal (sub)trees, keeping literal types apart."""
+    if isinstance(tree, dict):
+        return tuple( (op, tree_key(operands)) for op, operands in tree.items() )
+
+    if isinstance(tree, tuple):
+        return ('()',) + tuple( tree_key(param) for param in tree )
+
+    return (type(tree).__name__, tree)
+
+
+def count_subtrees(tree, counts: dict):
+    if isinstance(tree, dict):
+        key = tree_key(tree)
+        counts[key] = counts.get(key, 0) + 1
+
+        for operands in tree.values():
+            count_subtrees(operands, counts)
+
+    elif isinstance(tree, tuple):
+        for param in tree:
+            count_subtrees(param, counts)
+
+    return counts
+
+
+def memoize(node, key):
+    """Wraps a node compiled against PathValues so it runs at most once per document."""
+    def memoized(values):
+        if key in values:
+            return values[key]
+
+        value = values[key] = node(values)
+        return value
+
+    return memoized
 
-    # A String operator should always be a property-path
-    if isinstance(operator, str) and PATH_REGEX.search(operator) is not None:
-            logging.debug("Evaluating '%s' as path", operator)
 
-            value = get_value(json, operator)
+def count_calls(node, counter: list):
+    """Wraps a node to add its calls and their time to counter ([count, seconds])."""
+    def counted(json):
+        start = time.perf_counter()
+        try:
+            return node(json)
+        finally:
+            counter[0] += 1
+            counter[1] += time.perf_counter() - start
+
+    return counted
+
+
+def trace_resolve(resolve):
+    """Wraps a path resolver to log every lookup (--trace)."""
+    def traced(json, prop_path: PropertyPath):
+        logger.debug("Getting value of '%s'", prop_path)
+        value = resolve(json, prop_path)
+
+        if value is None:
+            logger.debug("Path '%s' not found - returning no value", prop_path)
+
+        return value
+
+    return traced
+
 
-            logging.debug(value)
-            return value
+def trace_node(node, description: str):
+    """Wraps a node to log its evaluation and result (--trace)."""
+    def traced(json):
+        logger.debug("Evaluating %s", description)
+        value = node(json)
+        logger.debug("%s evaluated to %r", description, value)
+        return value
 
-    # These are parameters, and need to be eval'd/returned individually
-    elif isinstance(operator, tuple):
-        logging.debug("Evaluating %s as parameters", repr(operator))
+    return traced
 
-        retv = tuple( evaluate(json, param) for param in operator )
 
-        logging.debug(repr(retv))
-        return retv
+def compile_tree(tree, comparisons: Comparisons, resolve=get_value, memoized=frozenset(), stats: Stats = None, trace=False):
+    """Compiles an expression tree from create_tree() into a predicate, looking paths up with resolve."""
+    if is_path(tree):
+        logger.debug("Compiling '%s' as path", tree)
+        path = PropertyPath(tree)
 
-    # This is an actual operator
-    if isinstance(operator, dict):
-        for op in operator:
+        if trace:
+            traced = trace_resolve(resolve)
+            return trace_node(lambda json: traced(json, path), f"'{tree}' as path")
+
+        return lambda json: resolve(json, path)
+
+    if isinstance(tree, dict):
+        for op in tree:
             if not op.startswith('-'):
                 break
 
-            logging.debug("Evaluating expression '%s'", op)
+            node = compile_operator(op, tree[op], comparisons, resolve, memoized, stats, trace)
 
-            lop = op.lower()
+            if trace:
+                node = trace_node(node, f"expression '{op}'")
 
-            if op.islower():
-                evaluator = Some
-            elif op.isupper():
-                evaluator = All
-            else:
-                logging.critical('Operator %s is of mixed case - cannot evaluate', op)
+            if stats is not None:
+                node = count_calls(node, stats.operator(op))
+
+            key = tree_key(tree)
+            if key in memoized:
+                logger.debug("Memoizing repeated expression '%s'", op)
+                node = memoize(node, key)
+
+            return node
+
+    logger.debug("Compiling '%s' as primitive %s", tree, type(tree).__name__)
+    return compile_literal(tree, trace)
+
+
+def is_literal(operand) -> bool:
+    return not isinstance(operand, (dict, tuple)) and not is_path(operand)
+
+
+def compile_literal(value, trace=False):
+    node = lambda json: value
+
+    return trace_node(node, f"'{value}' as primitive {type(value).__name__}") if trace else node
+
+
+def select_evaluator(op: str):
+    """Returns the Some (lower-case op) or All (upper-case op) evaluate function."""
+    if op.islower():
+        return Some.evaluate
+
+    if op.isupper():
+        return All.evaluate
+
+    logger.critical('Operator %s is of mixed case - cannot evaluate', op)
+    raise InvalidPathOrExpression(op, 'Operators must be all lower- or all upper-case')
+
+
+def compile_literal_regex(pattern):
+    """Returns an -mt/-rx callback with pattern compiled once, or None if pattern is not a literal string."""
+    if not isinstance(pattern, str) or is_path(pattern):
+        return None
+
+    try:
+        regex = re.compile(pattern)
+    except re.error as e:
+        raise InvalidPathOrExpression(pattern, f'Invalid regular expression: {e}')
+
+    return lambda a, b: regex.search(a) is not None
+
+
+def normalize_literals(op: str, operands: tuple, comparisons: Comparisons) -> tuple:
+    """Returns (callback, whether each operand is a literal, operands) with literals normalized once."""
+    normalized = [comparisons.normalize is not None and is_literal(operand) for operand in operands]
+
+    callback = comparisons.callback(op.lower(), *normalized)
+    if callback is None:
+        raise InvalidPathOrExpression(op, 'Unknown operator')
+
+    literals = tuple(
+        comparisons.normalize(operand) if literal else operand
+        for operand, literal in zip(operands, normalized)
+    )
 
-            params = operator[op]
+    return callback, normalized, literals
 
-            if lop == '-not':
-                param_0 = evaluate(json, params[0])
 
-                return evaluator.evaluate(lambda p: not p, param_0)
+def compile_operator(op: str, operands: tuple, comparisons: Comparisons, resolve, memoized, stats, trace):
+    logger.debug("Compiling expression '%s'", op)
 
-            if lop == '-and':
-                param_0 = evaluate(json, params[0])
-                param_1 = evaluate(json, params[1])
+    lop = op.lower()
+    evaluate = select_evaluator(op)
 
-                return evaluator.evaluate(lambda a, b: a and b, param_0, param_1)
+    params = tuple( compile_tree(operand, comparisons, resolve, memoized, stats, trace) for operand in operands )
 
-            if lop == '-or':
-                param_0 = evaluate(json, params[0])
-                param_1 = evaluate(json, params[1])
+    if lop == '-ex':
+        param_0, = params
+        return lambda json: param_0(json) is not None
 
-                return evaluator.evaluate(lambda a, b: a or b, param_0, param_1)
+    if lop == '-nex':
+        param_0, = params
+        return lambda json: param_0(json) is None
 
-            if lop == '-ex':
-                param_0 = evaluate(json, params[0])
+    if lop in UNARY_CALLBACKS:
+        callback = UNARY_CALLBACKS[lop]
+        param_0, = params
+        return lambda json: evaluate(callback, param_0(json))
 
-                return param_0 is not None
+    if lop == '-mt' or lop == '-rx':
+        callback = compile_literal_regex(operands[1]) or BINARY_CALLBACKS[lop]
+        param_0, param_1 = params
 
-            if lop == '-nex':
-                param_0 = evaluate(json, params[0])
+        def match(json):
+            a = param_0(json)
+            b = param_1(json)
 
-                return param_0 is None
+            if a is None:
+                return False
 
-            if lop == '-in':
-                param_0 = evaluate(json, params[0])
-                param_1 = evaluate(json, params[1])
+            if b is None:
+                logger.critical("Invalid regular expression '%s'", operands[1])
+                return False
 
-                return evaluator.evaluate(lambda a, b: a in b, param_0, param_1)
+            return evaluate(callback, a, b)
 
-            if lop == '-nin':
-                param_0 = evaluate(json, params[0])
-                param_1 = evaluate(json, params[1])
+        return match
 
-                return evaluator.evaluate(lambda a, b: a not in b, param_0, param_1)
+    # Operators always resolve to a single non-None value, for which both the
+    # Some and All evaluators reduce to `a and b` / `a or b`, so the second
+    # operand is only needed when the first does not decide the result
+    if (lop == '-and' or lop == '-or') and all(isinstance(operand, dict) for operand in operands):
+        callback = BINARY_CALLBACKS[lop]
+        param_0, param_1 = params
 
-            if lop == '-eq':
-                param_0 = evaluate(json, params[0])
-                param_1 = evaluate(json, params[1])
+        if lop == '-and':
+            def conjunction(json):
+                a = param_0(json)
+                if not a:
+                    return a
 
-                return evaluator.evaluate(lambda a, b: comparer.compare(a, b) == 0, param_0, param_1)
+                return evaluate(callback, a, param_1(json))
 
-            if lop == '-ne':
-                param_0 = evaluate(json, params[0])
-                param_1 = evaluate(json, params[1])
+            return conjunction
 
-                return evaluator.evaluate(lambda a, b: comparer.compare(a, b) != 0, param_0, param_1)
+        def disjunction(json):
+            a = param_0(json)
+            if a:
+                return a
 
-            if lop == '-mt' or lop == '-rx':
-                param_0 = evaluate(json, params[0])
-                param_1 = evaluate(json, params[1])
+            return evaluate(callback, a, param_1(json))
 
-                if param_0 is None:
+        return disjunction
+
+    callback = BINARY_CALLBACKS.get(lop)
+    if callback is None:
+        callback, normalized, literals = normalize_literals(op, operands, comparisons)
+
+        params = tuple(
+            compile_literal(value, trace) if literal else param
+            for value, param, literal in zip(literals, params, normalized)
+        )
+
+    else:
+        literals = operands
+
+    # Casefold leaves numbers as they are, but str() changes how they compare, so --string never vectorizes
+    vectorize = not comparisons.force_string and lop in COMPARISON_TESTS
+
+    # Compare wildcard paths element by element as they are resolved, unless
+    # values come from elsewhere (PathValues) or every node is traced
+    if resolve is get_value and not trace and lop != '-and' and lop != '-or':
+        node = compile_streaming(op, callback, operands, literals, vectorize)
+        if node is not None:
+            return node
+
+    param_0, param_1 = params
+
+    if vectorize and is_path(operands[0]) != is_path(operands[1]) and all(map(is_literal_or_path, operands)):
+        path_first = is_path(operands[0])
+        vector_test = compile_vector_test(lop, literals[1 if path_first else 0], path_first, op.isupper())
+
+        if vector_test is not None:
+            def vectorized(json):
+                a = param_0(json)
+                b = param_1(json)
+
+                values = a if path_first else b
+                if type(values) is list:
+                    retv = vector_test(values)
+                    if retv is not None:
+                        return retv
+
+                return evaluate(callback, a, b)
+
+            return vectorized
+
+    return lambda json: evaluate(callback, param_0(json), param_1(json))
+
+
+def is_literal_or_path(operand) -> bool:
+    return not isinstance(operand, (dict, tuple))
+
+
+def compile_streaming(op: str, callback, operands: tuple, literals: tuple, vectorize=False):
+    """Compiles wildcard-path comparisons to test the last step element by element, or returns None."""
+    for path_side in (0, 1):
+        path, other = operands[path_side], operands[1 - path_side]
+
+        if not is_path(path) or not is_literal(other):
+            continue
+
+        prop_path = PropertyPath(path)
+        if all(kind != PropertyPath.WILDCARD for kind, _, _ in prop_path.steps):
+            return None
+
+        # Everything up to the last step is resolved as usual
+        parent = PropertyPath(path.rsplit('.', 1)[0]) if len(prop_path.steps) > 1 else None
+        kind, key, idx = prop_path.steps[-1]
+
+        literal = literals[1 - path_side]
+        test = callback if path_side == 0 else lambda a, b: callback(b, a)
+
+        wildcard = kind == PropertyPath.WILDCARD
+        index = kind == PropertyPath.INDEX
+
+        vector_test = None
+        if vectorize and wildcard:
+            vector_test = compile_vector_test(op.lower(), literal, path_side == 0, op.isupper())
+
+        if op.isupper():
+            def every(json):
+                parents = [json] if parent is None else get_value(json, parent)
+                if parents is None:
+                    return False
+
+                for el in parents:
+                    if el is None:
+                        continue
+
+                    if key not in el:
+                        return False
+
+                    value = el[key]
+
+                    if index:
+                        if len(value) <= idx:
+                            return False
+                        value = value[idx]
+
+                    if vector_test is not None and type(value) is list:
+                        retv = vector_test(value)
+                        if retv is not None:
+                            if not retv:
+                                return False
+                            continue
+
+                    try:
+                        if wildcard:
+                            for x in value:
+                                if not test(x, literal):
+                                    return False
+
+                        elif not test(value, literal):
+                            return False
+
+                    except TypeError:
+                        return False
+
+                return True
+
+            return every
+
+        def some(json):
+            parents = [json] if parent is None else get_value(json, parent)
+            if parents is None:
+                return False
+
+            found = False
+            for el in parents:
+                if el is None:
+                    continue
+
+                if key not in el:
                     return False
 
-                if param_1 is None:
-                    logging.critical("Invalid regular expression '%s'", params[1])
+                value = el[key]
+
+                if index:
+                    if len(value) <= idx:
+                        return False
+                    value = value[idx]
+
+                if found:
+                    continue
+
+                if vector_test is not None and type(value) is list:
+                    retv = vector_test(value)
+                    if retv is not None:
+                        found = retv
+                        continue
+
+                try:
+                    if wildcard:
+                        for x in value:
+                            if test(x, literal):
+                                found = True
+                                break
+
+                    elif test(value, literal):
+                        found = True
+
+                except TypeError:
                     return False
 
-                return evaluator.evaluate(lambda a, b: re.search(b, a) is not None, param_0, param_1)
+            return found
+
+        return some
+
+    return None
+
+
+def compile_columns(tree, comparisons: Comparisons, stats: Stats = None, streaming=True):
+    """Compiles an expression tree from create_tree() into a node(columns, rows) over a ColumnStore."""
+    if is_path(tree):
+        logger.debug("Compiling '%s' as column", tree)
+        return lambda columns, rows: columns.take(tree, rows)
+
+    if isinstance(tree, dict):
+        for op in tree:
+            if not op.startswith('-'):
+                break
+
+            node = compile_column_operator(op, tree[op], comparisons, stats, streaming)
+
+            if stats is not None:
+                node = count_rows(node, stats.operator(op))
+
+            return node
+
+    logger.debug("Compiling '%s' as primitive %s", tree, type(tree).__name__)
+    return compile_column_literal(tree)
+
+
+def compile_column_literal(value):
+    return lambda columns, rows: [value] * len(rows)
+
+
+def count_rows(node, counter: list):
+    """Wraps a column node to add the rows it evaluates and their time to counter ([count, seconds])."""
+    def counted(columns, rows):
+        start = time.perf_counter()
+        try:
+            return node(columns, rows)
+        finally:
+            counter[0] += len(rows)
+            counter[1] += time.perf_counter() - start
+
+    return counted
+
+
+def compile_column_operator(op: str, operands: tuple, comparisons: Comparisons, stats, streaming):
+    logger.debug("Compiling expression '%s' over columns", op)
 
-            if lop == '-lt':
-                param_0 = evaluate(json, params[0])
-                param_1 = evaluate(json, params[1])
+    lop = op.lower()
+    evaluate = select_evaluator(op)
 
-                return evaluator.evaluate(lambda a, b: comparer.compare(a, b) < 0, param_0, param_1)
+    params = tuple( compile_columns(operand, comparisons, stats, streaming) for operand in operands )
 
-            if lop == '-le':
-                param_0 = evaluate(json, params[0])
-                param_1 = evaluate(json, params[1])
+    if lop == '-ex':
+        param_0, = params
+        return lambda columns, rows: [a is not None for a in param_0(columns, rows)]
 
-                return evaluator.evaluate(lambda a, b: comparer.compare(a, b) <= 0, param_0, param_1)
+    if lop == '-nex':
+        param_0, = params
+        return lambda columns, rows: [a is None for a in param_0(columns, rows)]
 
-            if lop == '-gt':
-                param_0 = evaluate(json, params[0])
-                param_1 = evaluate(json, params[1])
+    if lop in UNARY_CALLBACKS:
+        callback = UNARY_CALLBACKS[lop]
+        param_0, = params
+        return lambda columns, rows: [evaluate(callback, a) for a in param_0(columns, rows)]
 
-                return evaluator.evaluate(lambda a, b: comparer.compare(a, b) > 0, param_0, param_1)
+    if lop == '-mt' or lop == '-rx':
+        callback = compile_literal_regex(operands[1]) or BINARY_CALLBACKS[lop]
+        param_0, param_1 = params
 
-            if lop == '-ge':
-                param_0 = evaluate(json, params[0])
-                param_1 = evaluate(json, params[1])
+        def match(a, b):
+            if a is None:
+                return False
 
-                return evaluator.evaluate(lambda a, b: comparer.compare(a, b) >= 0, param_0, param_1)
+            if b is None:
+                logger.critical("Invalid regular expression '%s'", operands[1])
+                return False
 
-            if lop == '-len':
-                param_0 = evaluate(json, params[0])
+            return evaluate(callback, a, b)
 
-                return evaluator.evaluate(len, param_0)
+        return lambda columns, rows: list(map(match, param_0(columns, rows), param_1(columns, rows)))
 
-            if lop == '-obj':
-                param_0 = evaluate(json, params[0])
+    # As in compile_operator(), operators resolve to a single bool, so the
+    # second operand decides exactly the rows the first one does not
+    if (lop == '-and' or lop == '-or') and all(isinstance(operand, dict) for operand in operands):
+        param_0, param_1 = params
+        decided = (lambda a: not a) if lop == '-and' else bool
 
-                return evaluator.evaluate(lambda p: isinstance(p, dict), param_0)
+        def combine(columns, rows):
+            a = param_0(columns, rows)
 
-            if lop == '-arr':
-                param_0 = evaluate(json, params[0])
+            undecided = [row for row, x in zip(rows, a) if not decided(x)]
+            if not undecided:
+                return a
 
-                return evaluator.evaluate(lambda p: isinstance(p, list), param_0)
+            b = iter(param_1(columns, undecided))
+            return [x if decided(x) else next(b) for x in a]
 
-            if lop == '-str':
-                param_0 = evaluate(json, params[0])
+        return combine
 
-                return evaluator.evaluate(lambda p: isinstance(p, str), param_0)
+    callback = BINARY_CALLBACKS.get(lop)
+    if callback is None:
+        callback, normalized, literals = normalize_literals(op, operands, comparisons)
 
-            if lop == '-num':
-                param_0 = evaluate(json, params[0])
+        params = tuple(
+            compile_column_literal(value) if literal else param
+            for value, param, literal in zip(literals, params, normalized)
+        )
 
-                return evaluator.evaluate(lambda p: isinstance(p, int) or isinstance(p, float), param_0)
+    else:
+        literals = operands
+
+    param_0, param_1 = params
+
+    for path_side in (0, 1):
+        path, other = literals[path_side], literals[1 - path_side]
+
+        if is_path(path) and is_literal(other):
+            test = callback if path_side == 0 else lambda a, b: callback(b, a)
+            every = op.isupper()
+
+            row_node = compile_streaming(op, callback, operands, literals) if streaming else None
+            if row_node is None:
+                return lambda columns, rows: compare_column(columns.take(path, rows), test, other, every)
+
+            def compare(columns, rows):
+                results = compare_column(columns.take(path, rows, strict=False), test, other, every)
+
+                errors = columns.errors(path)
+                if errors:
+                    for i, row in enumerate(rows):
+                        if row in errors:
+                            results[i] = row_node(columns.document(row))
+
+                return results
+
+            return compare
+
+    return lambda columns, rows: list(map(
+        lambda a, b: evaluate(callback, a, b), param_0(columns, rows), param_1(columns, rows)))
+
+
+def compare_column(values: list, test, literal, every: bool) -> list:
+    """Tests each get_value() result in values against literal as the Some/All evaluators would."""
+    results = []
+    append = results.append
+
+    for value in values:
+        # A path that does not resolve is false either way
+        if value is None:
+            append(False)
+            continue
+
+        try:
+            if every:
+                retv = True
+                for x in value:
+                    if not test(x, literal):
+                        retv = False
+                        break
+            else:
+                retv = False
+                for x in value:
+                    if test(x, literal):
+                        retv = True
+                        break
+
+        except TypeError:
+            retv = False
+
+        append(retv)
+
+    return results
 
-            if lop == '-bool':
-                param_0 = evaluate(json, params[0])
 
-                return evaluator.evaluate(lambda p: isinstance(p, bool), param_0)
+DEFAULT_INCLUDE = ['*.json']
+DEFAULT_LINES_INCLUDE = ['*.jsonl', '*.ndjson', '*.json']
 
-    logging.debug("Evaluating '%s' as primitive %s", operator, type(operator).__name__)
-    return operator
 
+def list_files(args, entries=False):
+    # With entries, walked files are yielded as their os.DirEntry, whose stat() may need no system call
+    if args.files_from is not None:
+        # Listed files are only filtered by explicit globs
+        path_filter = PathFilter(args.include, args.exclude)
+        base = args.root if os.path.isdir(args.root) else ''
+
+        logger.info("Reading files to search from '%s'", args.files_from)
+        if args.files_from == '-':
+            yield from read_file_list(sys.stdin, base, path_filter)
+        else:
+            with open(args.files_from) as fin:
+                yield from read_file_list(fin, base, path_filter)
+        return
 
-def list_files(args):
     if os.path.isfile(args.root):
-        logging.info("Found '%s'", args.root)
+        logger.info("Found '%s'", args.root)
         yield args.root
         return
 
-    dir_path = args.root
+    include = args.include
+    if include is None:
+        include = DEFAULT_LINES_INCLUDE if getattr(args, 'lines', False) else DEFAULT_INCLUDE
 
-    logging.info("Searching for files under '%s'", dir_path)
+    path_filter = PathFilter(include, args.exclude)
+    max_depth = args.max_depth if args.recurse else 0
 
-    for root, dirs, files in os.walk(dir_path):
-        for f in files:
-            logging.debug("Found '%s'", f)
-            yield os.path.join(root, f)
+    logger.info("Searching for files under '%s' (%r)", args.root, path_filter)
 
-        if not args.recurse:
-            logging.debug("Halting recursive search")
-            return
+    walk = walk_entries if entries else walk_files
+    yield from walk(args.root, path_filter, max_depth)
 
 
 def sort_files(files):
@@ -407,6 +1051,9 @@ def sort_files(files):
 
 
 def set_logging_level(verbosity: int):
+    """Sets up logging for the command line and its worker processes; importing jql configures nothing."""
+    logging.basicConfig()
+
     if verbosity == 0:
         level = logging.WARNING
     elif verbosity == 1:
@@ -417,62 +1064,1170 @@ def set_logging_level(verbosity: int):
     logging.root.setLevel(level)
 
 
-def main():
-    global comparer
+def count_paths(tree, counts: dict):
+    if is_path(tree):
+        counts[tree] = counts.get(tree, 0) + 1
 
-    args, token_list = get_args()
+    elif isinstance(tree, tuple):
+        for param in tree:
+            count_paths(param, counts)
 
-    logging.info(args)
+    elif isinstance(tree, dict):
+        for operands in tree.values():
+            count_paths(operands, counts)
 
-    if args.insensitive:
-        comparer = InsensitiveComparer(comparer)
+    return counts
 
-    if args.force_string:
-        comparer = ForceStringComparer(comparer)
 
-    token_queue = Queue(token_list)
+class Query:
+    """An expression tree compiled for evaluation against documents; it keeps no state between them."""
 
-    logging.info('Creating expression tree...')
-    try:
-        tree = create_tree(token_queue, args.force_string)
-    except:
-        logging.critical("Could not parse expression: %s", ' '.join(map(lambda t: f'"{t}"', token_list)))
-        return
+    def __init__(self, tree, insensitive=False, force_string=False, prefilter=None, stats: Stats = None, trace=False):
+        self.tree = tree
+        self.insensitive = insensitive
+        self.force_string = force_string
+        self.prefilter = prefilter
 
-    count_all_files = 0
-    valid_files = []
-    for json_path in list_files(args):
+        comparisons = Comparisons(insensitive, force_string)
+
+        # Every path the expression refers to, for evaluating against extracted values
+        path_counts = count_paths(tree, {})
+        self.paths = {path: PropertyPath(path) for path in path_counts}
+
+        repeated = {key for key, count in count_subtrees(tree, {}).items() if count > 1}
+        self.values_predicate = compile_tree(tree, comparisons, get_stored_value, repeated, stats, trace)
+
+        if repeated or any(count > 1 for count in path_counts.values()):
+            # Resolve each path and repeated subexpression once per document
+            values_predicate = self.values_predicate
+            paths = self.paths
+            self.predicate = lambda json: values_predicate(PathValues(json, paths))
+            self.columns_predicate = compile_columns(tree, comparisons, stats, streaming=False)
+        else:
+            self.predicate = compile_tree(tree, comparisons, stats=stats, trace=trace)
+            self.columns_predicate = compile_columns(tree, comparisons, stats)
+
+    def extract(self, json) -> dict:
+        """Returns the value of every path in the expression, keyed by property-path."""
+        return {path: get_value(json, prop_path) for path, prop_path in self.paths.items()}
+
+    def match(self, json) -> bool:
+        """Returns whether a decoded JSON document matches."""
+        # Expressions always start with an operator, which resolves to a bool
+        return self.predicate(json)
+
+    def filter(self, documents):
+        """Lazily yields the documents of an iterable that match."""
+        return (json for json in documents if self.match(json))
+
+    def evaluate_columns(self, columns: ColumnStore) -> list:
+        """Returns whether each file in columns matches; every path must have a column."""
+        results = self.columns_predicate(columns, list(range(len(columns))))
+
+        return [check_result(json_path, retv) for json_path, retv in zip(columns.files, results)]
+
+
+def compile_query(token_list: list, insensitive=False, force_string=False, prefilter=False, stats: Stats = None,
+                  trace=False) -> Query:
+    tokens = Queue(list(token_list))
+    tree = create_tree(tokens, force_string)
+
+    # Anything but an operator at the root, or tokens after it, could only fail or be ignored per document
+    if not isinstance(tree, dict):
+        raise InvalidPathOrExpression(token_list[0], 'Expressions must start with an operator')
+
+    if len(tokens) > 0:
+        raise InvalidPathOrExpression(' '.join(token_list), f"Unexpected tokens after the expression: {tokens!r}")
+
+    if prefilter:
+        prefilter = build_prefilter(tree, is_path, insensitive, force_string)
+        logger.info('Prefilter: %s', prefilter)
+    else:
+        prefilter = None
+
+    return Query(tree, insensitive, force_string, prefilter, stats, trace)
+
+
+def compile(expression, insensitive=False, force_string=False) -> Query:
+    """Compiles an expression string or token list for use as a library; raises InvalidPathOrExpression."""
+    if isinstance(expression, str):
         try:
-            json_data = get_json(json_path)
+            token_list = shlex.split(expression)
+        except ValueError as e:
+            raise InvalidPathOrExpression(expression, str(e))
+    else:
+        token_list = [str(token) for token in expression]
 
-        except:
-            if json_path.endswith('.json'):
-                logging.info("Error parsing '%s' - skipping", json_path)
-            else:
-                logging.debug("Error parsing '%s' - skipping", json_path)
+    if not token_list:
+        raise InvalidPathOrExpression('', 'Empty expression')
 
-            continue
+    try:
+        return compile_query(token_list, insensitive, force_string)
+    except IndexError:
+        raise InvalidPathOrExpression(' '.join(token_list), 'Missing operands')
 
-        count_all_files += 1
 
-        retv = evaluate(json_data, tree)
-        logging.debug("File '%s' evaluated to '%s'", json_path, retv)
+def read_batch(path: str) -> list:
+    """Returns [(name, tokens)] from a file of 'name: expression' lines."""
+    entries = []
 
-        if not isinstance(retv, bool):
-            raise TypeError(f"JQL does not resolve to a boolean (resolves to '{retv}')")
+    with open(path, 'r') as fin:
+        for line in fin:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
 
-        if retv:
-            valid_files.append(json_path)
+            name, sep, expression = line.partition(':')
+            if not sep:
+                raise InvalidPathOrExpression(line, "Expected 'name: expression'")
 
-    if not args.list:
-        print(f"Files matching search criteria...")
+            entries.append((name.strip(), shlex.split(expression)))
 
-    for vf in sort_files(valid_files):
-        print(f"{vf}")
+    return entries
 
-    if not args.list:
-        print(f"({len(valid_files)}/{count_all_files} files match)")
 
+class Batch:
+    """Several queries evaluated together, resolving each distinct path once per document."""
 
-if __name__ == "__main__":
-    main()
+    def __init__(self, names: list, queries: list):
+        self.names = names
+        self.queries = queries
+
+        self.paths = {}
+        for query in queries:
+            self.paths.update(query.paths)
+
+    def evaluate(self, json_path: str, json, selected: list) -> tuple:
+        values = PathValues(json, self.paths)
+
+        return tuple(
+            check_result(json_path, query.values_predicate(values)) if use else False
+            for query, use in zip(self.queries, selected)
+        )
+
+
+def compile_batch(entries: list, insensitive=False, force_string=False, prefilter=False, trace=False) -> Batch:
+    names = []
+    queries = []
+
+    for name, token_list in entries:
+        names.append(name)
+        queries.append(compile_query(token_list, insensitive, force_string, prefilter, trace=trace))
+
+    return Batch(names, queries)
+
+
+def log_parse_error(json_path: str):
+    if json_path.endswith('.json'):
+        logger.info("Error parsing '%s' - skipping", json_path)
+    else:
+        logger.debug("Error parsing '%s' - skipping", json_path)
+
+
+def check_result(json_path: str, retv) -> bool:
+    logger.debug("File '%s' evaluated to '%s'", json_path, retv)
+
+    if not isinstance(retv, bool):
+        raise TypeError(f"JQL does not resolve to a boolean (resolves to '{retv}')")
+
+    return retv
+
+
+def decode_selected(raw, name: str, prefilters: list, stats: Stats = None):
+    """Returns (document or Rejected, whether each prefilter passed raw); raises if raw is not valid JSON."""
+    mark = time.perf_counter() if stats is not None else None
+
+    if sniff_encoding(raw[:4]) is None:
+        selected = [prefilter is None or prefilter(raw) for prefilter in prefilters]
+    else:
+        # Prefilters search for UTF-8 bytes, which a UTF-16 or UTF-32 document never contains
+        selected = [True] * len(prefilters)
+
+    if stats is not None and any(prefilter is not None for prefilter in prefilters):
+        mark = stats.lap('prefilter', mark)
+
+    if not any(selected):
+        # Anything but an object or array is decoded as usual, to tell scalars from invalid JSON
+        if looks_like_json(raw):
+            logger.debug("'%s' rejected by prefilter", name)
+            if stats is not None:
+                stats.prefiltered += 1
+
+            return Rejected, selected
+
+        selected = [True] * len(selected)
+
+    json_data = decode_json(raw, name)
+    if stats is not None:
+        stats.lap('decode', mark)
+
+    return json_data, selected
+
+
+def evaluate_raw(raw, name: str, query: Query, stats: Stats = None):
+    """Returns whether raw matches, None if it is not valid JSON, or Rejected by the prefilter."""
+    try:
+        json_data, _ = decode_selected(raw, name, [query.prefilter], stats)
+    except:
+        log_parse_error(name)
+        return None
+
+    if json_data is Rejected:
+        return Rejected
+
+    mark = time.perf_counter() if stats is not None else None
+    retv = check_result(name, query.predicate(json_data))
+    if stats is not None:
+        stats.lap('evaluate', mark)
+
+    return retv
+
+
+def evaluate_file(json_path: str, query: Query, cache: PathCache = None, stats: Stats = None):
+    """Returns whether the file matches, None if it is not valid JSON, or Rejected by the prefilter."""
+    start = time.perf_counter() if stats is not None else None
+
+    if cache is not None:
+        retv = evaluate_cached_file(json_path, query, cache)
+        if stats is not None:
+            stats.lap('evaluate', start)
+
+    else:
+        try:
+            with read_file(json_path) as raw:
+                if stats is not None:
+                    # Memory-mapped files are only paged in by the phases after this
+                    stats.bytes_read += len(raw)
+                    stats.lap('read', start)
+
+                retv = evaluate_raw(raw, json_path, query, stats)
+
+        except OSError:
+            log_parse_error(json_path)
+            retv = None
+
+    if stats is not None:
+        if retv is None:
+            stats.parse_errors += 1
+        else:
+            stats.add_file(json_path, time.perf_counter() - start)
+
+    return retv
+
+
+def evaluate_cached_file(json_path: str, query: Query, cache: PathCache):
+    try:
+        stat = os.stat(json_path)
+    except OSError:
+        log_parse_error(json_path)
+        return None
+
+    values = cache.get(json_path, stat, query.paths)
+
+    if values is InvalidFile:
+        log_parse_error(json_path)
+        return None
+
+    if values is None:
+        # Misses are decoded in full (no prefilter) so every path can be cached
+        try:
+            json_data = get_json(json_path)
+        except:
+            cache.put(json_path, stat, None)
+            log_parse_error(json_path)
+            return None
+
+        try:
+            values = query.extract(json_data)
+        except TypeError:
+            # A path the expression may never reach cannot be resolved in this document
+            return check_result(json_path, query.predicate(json_data))
+
+        cache.put(json_path, stat, values)
+
+    else:
+        logger.debug("Using cached values for '%s'", json_path)
+
+    return check_result(json_path, query.values_predicate(values))
+
+
+def evaluate_batch_file(json_path: str, batch: Batch):
+    """Returns each query's result for the file, None if it is not valid JSON, or Rejected by every prefilter."""
+    try:
+        with read_file(json_path) as raw:
+            json_data, selected = decode_selected(raw, json_path, [query.prefilter for query in batch.queries])
+
+    except:
+        log_parse_error(json_path)
+        return None
+
+    if json_data is Rejected:
+        return Rejected
+
+    return batch.evaluate(json_path, json_data, selected)
+
+
+def extract_file(json_path: str, paths: dict):
+    """Returns the values of paths in the file for a ColumnStore, or None if it is not valid JSON."""
+    try:
+        json_data = get_json(json_path)
+    except:
+        log_parse_error(json_path)
+        return None
+
+    return extract_file_values(json_data, paths)
+
+
+def extract_file_values(json_data, paths: dict) -> dict:
+    """Returns the values of paths (compiled, keyed by property-path) in json_data, or the exception resolving each raised."""
+    values = {}
+    for path, prop_path in paths.items():
+        try:
+            values[path] = get_value(json_data, prop_path)
+        except Exception as e:
+            # Only raised if the expression reaches the path in this file
+            values[path] = e
+
+    return values
+
+
+# Compiled predicates cannot be pickled, so each worker process compiles its own
+_worker_query = None
+_worker_cache = None
+_worker_batch = None
+_worker_stats = None
+_worker_paths = None
+
+
+def init_worker(token_list: list, insensitive: bool, force_string: bool, prefilter: bool, cache_path: str, verbosity: int,
+                trace: bool, slowest: int = None):
+    global _worker_query, _worker_cache, _worker_stats
+
+    set_logging_level(verbosity)
+
+    if slowest is not None:
+        _worker_stats = Stats(slowest)
+
+    _worker_query = compile_query(token_list, insensitive, force_string, prefilter, _worker_stats, trace)
+
+    if cache_path is not None:
+        _worker_cache = PathCache(cache_path)
+        multiprocessing.util.Finalize(_worker_cache, _worker_cache.close, exitpriority=10)
+
+
+def init_watch_worker(*initargs):
+    # Ctrl-C ends --watch in the main process, which then terminates the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    init_worker(*initargs)
+
+
+def evaluate_file_in_worker(json_path: str):
+    return json_path, evaluate_file(json_path, _worker_query, _worker_cache)
+
+
+def evaluate_files_with_stats_in_worker(json_paths: list):
+    results = [(json_path, evaluate_file(json_path, _worker_query, _worker_cache, _worker_stats)) for json_path in json_paths]
+
+    # Hand this chunk's share over and start afresh for the next one
+    chunk_stats = copy.deepcopy(_worker_stats)
+    _worker_stats.reset()
+
+    return results, chunk_stats
+
+
+def init_batch_worker(entries: list, insensitive: bool, force_string: bool, prefilter: bool, verbosity: int, trace: bool):
+    global _worker_batch
+
+    set_logging_level(verbosity)
+    _worker_batch = compile_batch(entries, insensitive, force_string, prefilter, trace)
+
+
+def evaluate_batch_file_in_worker(json_path: str):
+    return json_path, evaluate_batch_file(json_path, _worker_batch)
+
+
+def init_extract_worker(paths: list, verbosity: int):
+    global _worker_paths
+
+    set_logging_level(verbosity)
+    _worker_paths = {path: PropertyPath(path) for path in paths}
+
+
+def extract_file_in_worker(json_path: str):
+    return extract_file(json_path, _worker_paths)
+
+
+def init_serve_worker(verbosity: int):
+    # As with --watch, Ctrl-C ends serve in the main process, which then terminates the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    set_logging_level(verbosity)
+
+
+def load_document(json_path: str):
+    try:
+        return json_path, get_json(json_path)
+    except:
+        log_parse_error(json_path)
+        return json_path, None
+
+
+# Number of paths handed to a worker at a time
+JOBS_CHUNKSIZE = 64
+
+
+def chunked(iterable, size: int):
+    """Yields lists of size consecutive items of iterable, the last one possibly shorter."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+
+        yield chunk
+
+
+def lookup_files(index_path: str, query: Query, files, remaining: list):
+    """Yields (path, result) for files the index can answer, and appends the rest to remaining."""
+    index = InvertedIndex(index_path)
+    try:
+        known = index.files()
+        true_ids, unknown_ids = index.answer(query.tree, is_path, query.insensitive, query.force_string)
+    finally:
+        index.close()
+
+    for json_path in files:
+        entry = known.get(os.path.abspath(json_path))
+
+        if entry is not None:
+            file_id, mtime_ns, size, valid = entry
+            try:
+                stat = os.stat(json_path)
+            except OSError:
+                stat = None
+
+            if stat is not None and stat.st_mtime_ns == mtime_ns and stat.st_size == size:
+                if not valid:
+                    log_parse_error(json_path)
+                    yield json_path, None
+                    continue
+
+                if file_id not in unknown_ids:
+                    yield json_path, file_id in true_ids
+                    continue
+
+        remaining.append(json_path)
+
+
+def scan_files(args, token_list: list, query: Query, stats: Stats = None):
+    """Yields (path, result) for every file found, as given by evaluate_file()."""
+    files = list_files(args)
+
+    if stats is not None:
+        files = stats.timed('discovery', files)
+
+    if args.index is not None:
+        remaining = []
+        for json_path, retv in lookup_files(args.index, query, files, remaining):
+            if stats is not None:
+                stats.indexed += 1
+            yield json_path, retv
+        files = remaining
+
+    if args.jobs == 1:
+        cache = PathCache(args.cache) if args.cache is not None else None
+
+        try:
+            for json_path in files:
+                yield json_path, evaluate_file(json_path, query, cache, stats)
+        finally:
+            if cache is not None:
+                cache.close()
+
+        return
+
+    initargs = (token_list, args.insensitive, args.force_string, args.prefilter, args.cache, args.verbosity, args.trace)
+    if stats is not None:
+        initargs += (stats.slowest_count,)
+
+    with multiprocessing.Pool(args.jobs or None, init_worker, initargs) as pool:
+        if stats is None:
+            yield from pool.imap_unordered(evaluate_file_in_worker, files, JOBS_CHUNKSIZE)
+
+        else:
+            # Whole chunks go to each worker, so their stats are merged once per chunk rather than per file
+            for results, chunk_stats in pool.imap_unordered(evaluate_files_with_stats_in_worker, chunked(files, JOBS_CHUNKSIZE)):
+                stats.merge(chunk_stats)
+                yield from results
+
+        # Let workers exit normally so they can flush their caches
+        pool.close()
+        pool.join()
+
+
+def scan_batch(args, entries: list, batch: Batch):
+    """Yields (path, results) for every file found, as given by evaluate_batch_file()."""
+    files = list_files(args)
+
+    if args.jobs == 1:
+        for json_path in files:
+            yield json_path, evaluate_batch_file(json_path, batch)
+        return
+
+    initargs = (entries, args.insensitive, args.force_string, args.prefilter, args.verbosity, args.trace)
+    with multiprocessing.Pool(args.jobs or None, init_batch_worker, initargs) as pool:
+        yield from pool.imap_unordered(evaluate_batch_file_in_worker, files, JOBS_CHUNKSIZE)
+
+        pool.close()
+        pool.join()
+
+
+def extract_files(args, files: list, paths: list):
+    """Yields extract_file() of paths for each of files, in order."""
+    if args.jobs == 1 or len(files) <= JOBS_CHUNKSIZE:
+        compiled = {path: PropertyPath(path) for path in paths}
+        for json_path in files:
+            yield extract_file(json_path, compiled)
+        return
+
+    with multiprocessing.Pool(args.jobs or None, init_extract_worker, (paths, args.verbosity)) as pool:
+        # Rows must stay in file order
+        yield from pool.imap(extract_file_in_worker, files, JOBS_CHUNKSIZE)
+
+        pool.close()
+        pool.join()
+
+
+def load_columns(args, columns: ColumnStore, paths, stats: Stats = None):
+    """Reads the files of columns once for whichever of paths have no column yet."""
+    missing = columns.missing(paths)
+    if columns.loaded and not missing:
+        return
+
+    logger.info('Extracting %d paths from %d files...', len(missing), len(columns.files))
+    start = time.perf_counter()
+
+    columns.add(missing, extract_files(args, columns.files, missing))
+
+    if stats is not None:
+        stats.lap('decode', start)
+
+
+def open_columns(args, stats: Stats = None) -> ColumnStore:
+    if args.cache is not None or args.index is not None or args.trace:
+        logger.warning('--cache, --index and --trace are not used with --columnar')
+
+    files = list_files(args)
+    if stats is not None:
+        files = stats.timed('discovery', files)
+
+    return ColumnStore(files, get_json)
+
+
+def scan_columns(args, token_list: list, query: Query, stats: Stats = None):
+    """Yields (path, result) for every valid JSON file found, evaluating query a column at a time."""
+    columns = open_columns(args, stats)
+    load_columns(args, columns, query.paths, stats)
+
+    start = time.perf_counter()
+    results = query.evaluate_columns(columns)
+
+    if stats is not None:
+        stats.lap('evaluate', start)
+        stats.files += len(columns.files)
+        stats.parse_errors += len(columns.invalid)
+
+    yield from zip(columns.files, results)
+
+
+def scan_batch_columns(args, entries: list, batch: Batch):
+    """Yields (path, results) for every valid JSON file found, evaluating each query a column at a time."""
+    columns = open_columns(args)
+    load_columns(args, columns, batch.paths)
+
+    results = [query.evaluate_columns(columns) for query in batch.queries]
+
+    yield from zip(columns.files, zip(*results))
+
+
+def stat_files(files) -> dict:
+    """Returns {path: (mtime_ns, size)} for each of files (paths or os.DirEntry) that can be stat'ed."""
+    stamps = {}
+    for file in files:
+        json_path = file if isinstance(file, str) else file.path
+        try:
+            stat = os.stat(file) if isinstance(file, str) else file.stat()
+        except OSError:
+            log_parse_error(json_path)
+            continue
+
+        stamps[json_path] = (stat.st_mtime_ns, stat.st_size)
+
+    return stamps
+
+
+class Corpus:
+    """The files under a root, each decoded once and held in memory, with columns extracted as queries need them."""
+
+    def __init__(self, args, pool=None):
+        self.args = args
+        self._pool = pool
+
+        # A published store and its documents are never modified, so queries use them without locking;
+        # updates build new ones under _update_lock and swap them in under _lock
+        self._documents = {}
+        self._columns = ColumnStore(load=self._documents.__getitem__)
+        self._lock = threading.Lock()
+        self._update_lock = threading.Lock()
+
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _current(self) -> tuple:
+        with self._lock:
+            return self._columns, self._documents
+
+    def _publish(self, columns: ColumnStore, documents: dict):
+        with self._lock:
+            self._columns = columns
+            self._documents = documents
+
+    def _load(self, files: list) -> dict:
+        """Returns {path: document, or None if not valid JSON} for files."""
+        if self._pool is None or len(files) <= JOBS_CHUNKSIZE:
+            return dict(map(load_document, files))
+
+        return dict(self._pool.imap_unordered(load_document, files, JOBS_CHUNKSIZE))
+
+    def refresh(self):
+        """Reads files added or changed under the root since the last refresh, and drops removed files."""
+        stamps = stat_files(list_files(self.args, entries=True))
+
+        # Only this method changes the rows, and it is never run concurrently
+        columns, _ = self._current()
+        known = dict(zip(columns.files, columns.stamps))
+        known.update(columns.invalid)
+
+        changed = [json_path for json_path, stamp in stamps.items() if known.get(json_path) != stamp]
+        if not changed and len(known) == len(stamps):
+            return
+
+        loaded = self._load(changed)
+
+        def extract(files: list, paths: list):
+            compiled = {path: PropertyPath(path) for path in paths}
+            for json_path in files:
+                json_data = loaded[json_path]
+                yield None if json_data is None else extract_file_values(json_data, compiled)
+
+        with self._update_lock:
+            columns, documents = self._current()
+            columns = columns.snapshot()
+            added, removed = columns.sync(stamps, extract)
+
+            documents = {json_path: loaded[json_path] if json_path in loaded else documents[json_path] for json_path in columns.files}
+            columns.load = documents.__getitem__
+
+            self._publish(columns, documents)
+
+        logger.info('Read %d new or changed files, dropped %d changed or removed files', added, removed)
+
+    def columns(self, paths) -> ColumnStore:
+        """Returns the current store, first extracting any of paths not extracted yet from the documents in memory."""
+        columns, _ = self._current()
+        if not columns.missing(paths):
+            return columns
+
+        with self._update_lock:
+            columns, documents = self._current()
+            missing = columns.missing(paths)
+
+            if missing:
+                logger.info('Extracting %d paths from %d files...', len(missing), len(columns.files))
+                compiled = {path: PropertyPath(path) for path in missing}
+
+                columns = columns.snapshot()
+                columns.add(missing, (extract_file_values(documents[json_path], compiled) for json_path in columns.files))
+
+                self._publish(columns, documents)
+
+        return columns
+
+    def start(self, interval: float):
+        """Refreshes the files every interval seconds in a background thread, until stop()."""
+        self._thread = threading.Thread(target=self._poll, args=(interval,), name='refresh', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+        if self._thread is not None:
+            self._thread.join()
+
+    def _poll(self, interval: float):
+        while not self._stopped.wait(interval):
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception('Could not refresh files')
+
+    def answer(self, request: dict) -> dict:
+        """Answers a request with the sorted matching files and the counts main() prints."""
+        expression = request.get('expression')
+        if not isinstance(expression, (str, list)):
+            raise BadRequest("Expected 'expression' as a string or a list of tokens")
+
+        try:
+            query = compile(expression, bool(request.get('insensitive')), bool(request.get('string')))
+        except InvalidPathOrExpression as e:
+            raise BadRequest(str(e))
+
+        columns = self.columns(query.paths)
+        results = query.evaluate_columns(columns)
+
+        matches = [json_path for json_path, retv in zip(columns.files, results) if retv]
+
+        return {'matches': sort_files(matches), 'count': len(matches), 'files': len(columns.files)}
+
+
+def watch_files(args, token_list: list, query: Query):
+    """Yields (started, stopped, {file: result}) for every poll, reading only added or changed files."""
+    stamps = {}
+    # {path: True, False or Rejected} of every file that is not invalid JSON
+    results = {}
+
+    cache = None
+    pool = None
+    if args.jobs == 1:
+        cache = PathCache(args.cache) if args.cache is not None else None
+    else:
+        initargs = (token_list, args.insensitive, args.force_string, args.prefilter, args.cache, args.verbosity, args.trace)
+        pool = multiprocessing.Pool(args.jobs or None, init_watch_worker, initargs)
+
+    try:
+        while True:
+            current = stat_files(list_files(args, entries=True))
+
+            changed = [json_path for json_path, stamp in current.items() if stamps.get(json_path) != stamp]
+            removed = [json_path for json_path in stamps if json_path not in current]
+            stamps = current
+
+            logger.info('%d files added or changed, %d removed', len(changed), len(removed))
+
+            started = []
+            stopped = [json_path for json_path in removed if results.pop(json_path, None) is True]
+
+            if pool is not None:
+                evaluated = pool.imap_unordered(evaluate_file_in_worker, changed, JOBS_CHUNKSIZE)
+            else:
+                evaluated = ( (json_path, evaluate_file(json_path, query, cache)) for json_path in changed )
+
+            for json_path, retv in evaluated:
+                matched = results.get(json_path) is True
+
+                if retv is None:
+                    results.pop(json_path, None)
+                else:
+                    results[json_path] = retv
+
+                if retv is True and not matched:
+                    started.append(json_path)
+                elif matched and retv is not True:
+                    stopped.append(json_path)
+
+            yield sort_files(started), sort_files(stopped), results
+
+            time.sleep(args.interval)
+
+    finally:
+        if pool is not None:
+            pool.terminate()
+        if cache is not None:
+            cache.close()
+
+
+def watch_main(args, token_list: list, query: Query):
+    if args.index is not None or args.columnar or args.unsorted:
+        logger.warning('--index, --columnar and --unsorted are not used with --watch')
+
+    if not args.list:
+        print(f"Watching for files matching search criteria...", flush=True)
+
+    try:
+        for started, stopped, results in watch_files(args, token_list, query):
+            for json_path in started:
+                print(f"+ {json_path}")
+            for json_path in stopped:
+                print(f"- {json_path}")
+
+            if (started or stopped) and not args.list:
+                retvs = list(results.values())
+                rejected = retvs.count(Rejected)
+                print(match_summary(retvs.count(True), len(retvs) - rejected, rejected))
+
+            sys.stdout.flush()
+
+    except KeyboardInterrupt:
+        pass
+
+
+def open_sources(args):
+    """Yields (source, binary file) for stdin ('-') or every file under root."""
+    if args.root == '-':
+        logger.info('Reading records from stdin')
+        yield '-', sys.stdin.buffer
+        return
+
+    for source in list_files(args):
+        logger.info("Reading records from '%s'", source)
+        try:
+            fin = open(source, 'rb')
+        except OSError:
+            log_parse_error(source)
+            continue
+
+        with fin:
+            yield source, fin
+
+
+def scan_lines(args, query: Query):
+    """Yields (name, raw record, result) for every record of every JSON Lines source."""
+    for source, fin in open_sources(args):
+        for lineno, raw in enumerate(fin, 1):
+            if not raw.strip():
+                continue
+
+            name = f'{source}:{lineno}'
+            yield name, raw, evaluate_raw(raw, name, query)
+
+
+def scan_elements(args, query: Query):
+    """Yields (name, element text, result) for every element of every top-level array source."""
+    for source, fin in open_sources(args):
+        encoding = sniff_encoding(fin.peek(4)[:4]) or locale.getpreferredencoding(False)
+        done = 0
+
+        while True:
+            try:
+                for index, element, text in ArrayReader(fin, encoding):
+                    # Elements already reported before an encoding retry
+                    if index < done:
+                        continue
+
+                    done = index + 1
+                    name = f'{source}[{index}]'
+                    yield name, text, check_result(name, query.predicate(element))
+
+            except UnicodeDecodeError:
+                if encoding != 'cp1252' and fin.seekable():
+                    logger.debug("Using cp1252 encoding for '%s'", source)
+                    encoding = 'cp1252'
+                    fin.seek(0)
+                    continue
+
+                log_parse_error(source)
+
+            except ValueError:
+                log_parse_error(source)
+
+            break
+
+
+def match_summary(matched: int, decoded: int, rejected: int, unit='files') -> str:
+    """The '(matched/searched files match)' line, where the files searched include those the prefilter rejected."""
+    summary = f"({matched}/{decoded + rejected} {unit} match"
+    if rejected:
+        summary += f", {rejected} rejected by prefilter"
+
+    return summary + ')'
+
+
+def records_main(args, query: Query):
+    if args.cache is not None or args.index is not None or args.jobs != 1:
+        logger.warning('--cache, --index and --jobs are not used with --lines or --elements')
+
+    if not args.list:
+        print(f"Records matching search criteria...")
+
+    count_all_records = 0
+    count_valid_records = 0
+    count_rejected = 0
+    for name, record, retv in (scan_lines if args.lines else scan_elements)(args, query):
+        if retv is None:
+            continue
+
+        if retv is Rejected:
+            count_rejected += 1
+            continue
+
+        count_all_records += 1
+
+        if not retv:
+            continue
+
+        count_valid_records += 1
+
+        if not args.records:
+            print(f"{name}", flush=True)
+        elif isinstance(record, str):
+            print(record, flush=True)
+        else:
+            # Write lines back byte-for-byte, whatever their encoding
+            sys.stdout.flush()
+            sys.stdout.buffer.write(record if record.endswith(b'\n') else record + b'\n')
+            sys.stdout.buffer.flush()
+
+    if not args.list:
+        print(match_summary(count_valid_records, count_all_records, count_rejected, 'records'))
+
+
+def batch_main(args):
+    try:
+        entries = read_batch(args.batch)
+        batch = compile_batch(entries, args.insensitive, args.force_string, args.prefilter, args.trace)
+    except InvalidPathOrExpression as e:
+        logger.critical(e)
+        return
+    except:
+        logger.critical("Could not parse batch file '%s'", args.batch)
+        return
+
+    if (args.cache is not None or args.index is not None) and not args.columnar:
+        logger.warning('--cache and --index are not used in batch mode')
+
+    if args.watch:
+        logger.warning('--watch is not used in batch mode')
+
+    if args.stats:
+        logger.warning('--stats is not supported in batch mode')
+
+    if args.lines or args.elements:
+        logger.warning('--lines and --elements are not supported in batch mode; each file is searched as one document')
+
+    count_all_files = 0
+    count_rejected = 0
+    count_valid_files = [0] * len(batch.names)
+    valid_files = [[] for _ in batch.names]
+    scan = scan_batch_columns if args.columnar else scan_batch
+    for json_path, results in scan(args, entries, batch):
+        if results is None:
+            continue
+
+        if results is Rejected:
+            count_rejected += 1
+            continue
+
+        count_all_files += 1
+
+        for i, retv in enumerate(results):
+            if not retv:
+                continue
+
+            count_valid_files[i] += 1
+
+            if args.unsorted:
+                print(f"{batch.names[i]}\t{json_path}", flush=True)
+            else:
+                valid_files[i].append(json_path)
+
+    for name, files, count in zip(batch.names, valid_files, count_valid_files):
+        if args.list:
+            for vf in sort_files(files):
+                print(f"{name}\t{vf}")
+            continue
+
+        if not args.unsorted:
+            print(f"Files matching '{name}'...")
+
+            for vf in sort_files(files):
+                print(f"{vf}")
+
+        print(f"'{name}': {match_summary(count, count_all_files, count_rejected)}")
+
+
+def main():
+    args, token_list = get_args()
+
+    logger.info(args)
+
+    if args.batch is not None:
+        batch_main(args)
+        return
+
+    start = time.perf_counter()
+    stats = Stats(args.slowest) if args.stats else None
+
+    logger.info('Creating expression tree...')
+    try:
+        query = compile_query(token_list, args.insensitive, args.force_string, args.prefilter, stats, args.trace)
+    except InvalidPathOrExpression as e:
+        logger.critical(e)
+        return
+    except:
+        logger.critical("Could not parse expression: %s", ' '.join(map(lambda t: f'"{t}"', token_list)))
+        return
+
+    if args.lines or args.elements:
+        if args.columnar or args.watch:
+            logger.warning('--columnar and --watch are not used with --lines or --elements')
+        if stats is not None:
+            logger.warning('--stats is not supported with --lines or --elements')
+        records_main(args, query)
+        return
+
+    if args.watch:
+        if stats is not None:
+            logger.warning('--stats is not supported with --watch')
+        watch_main(args, token_list, query)
+        return
+
+    if not args.list:
+        print(f"Files matching search criteria...")
+
+    count_all_files = 0
+    count_valid_files = 0
+    count_rejected = 0
+    valid_files = []
+    scan = scan_columns if args.columnar else scan_files
+    for json_path, retv in scan(args, token_list, query, stats):
+        if retv is None:
+            continue
+
+        if retv is Rejected:
+            count_rejected += 1
+            continue
+
+        count_all_files += 1
+
+        if not retv:
+            continue
+
+        count_valid_files += 1
+
+        if args.unsorted:
+            print(f"{json_path}", flush=True)
+        else:
+            valid_files.append(json_path)
+
+    for vf in sort_files(valid_files):
+        print(f"{vf}")
+
+    if not args.list:
+        print(match_summary(count_valid_files, count_all_files, count_rejected))
+
+    if stats is not None:
+        stats.wall = time.perf_counter() - start
+        print(stats.format(args.stats_format), file=sys.stderr)
+
+
+def index_main():
+    args = get_index_args()
+
+    logger.info(args)
+
+    if args.paths is not None:
+        prop_paths = set(args.paths)
+
+        for prop_path in prop_paths:
+            if not is_path(prop_path):
+                logger.critical(InvalidPathOrExpression(prop_path, 'Not a property-path'))
+                return
+
+    else:
+        logger.info('Collecting leaf paths...')
+        prop_paths = set()
+
+        for json_path in list_files(args):
+            try:
+                prop_paths.update(leaf_paths(get_json(json_path)))
+            except:
+                log_parse_error(json_path)
+
+    compiled_paths = {prop_path: PropertyPath(prop_path) for prop_path in prop_paths}
+
+    index = InvertedIndex(args.index)
+    index.clear(prop_paths)
+
+    count_files = 0
+    for json_path in list_files(args):
+        try:
+            stat = os.stat(json_path)
+        except OSError:
+            log_parse_error(json_path)
+            continue
+
+        try:
+            json_data = get_json(json_path)
+        except:
+            log_parse_error(json_path)
+            index.add_file(json_path, stat, None)
+            continue
+
+        try:
+            values = {prop_path: get_value(json_data, path) for prop_path, path in compiled_paths.items()}
+        except TypeError:
+            logger.info("Could not index '%s' - it will always be fully evaluated", json_path)
+            continue
+
+        index.add_file(json_path, stat, values)
+        count_files += 1
+
+    index.close()
+
+    print(f"Indexed {len(prop_paths)} paths over {count_files} files")
+
+
+def serve_main():
+    args = get_serve_args()
+
+    logger.info(args)
+
+    for prop_path in args.paths:
+        if not is_path(prop_path):
+            logger.critical(InvalidPathOrExpression(prop_path, 'Not a property-path'))
+            return
+
+    if args.socket is not None and UnixQueryServer is None:
+        logger.critical('Unix sockets are not supported on this platform')
+        return
+
+    # Started before any other thread, and spawned rather than forked, since it is used from the refresh thread
+    pool = None
+    if args.jobs != 1:
+        pool = multiprocessing.get_context('spawn').Pool(args.jobs or None, init_serve_worker, (args.verbosity,))
+
+    corpus = Corpus(args, pool)
+    corpus.refresh()
+    columns = corpus.columns(args.paths)
+    corpus.start(args.interval)
+
+    if args.socket is not None:
+        server = UnixQueryServer(args.socket, corpus.answer)
+    else:
+        server = QueryServer(args.port, corpus.answer)
+
+    print(f"Serving {len(columns.files)} files on {server.address}", flush=True)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        corpus.stop()
+        server.server_close()
+
+        if pool is not None:
+            pool.terminate()
+
+        if args.socket is not None:
+            os.unlink(args.socket)
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+
+    if sys.argv[1:2] == ['index']:
+        index_main()
+    elif sys.argv[1:2] == ['serve']:
+        serve_main()
+    else:
+        main()
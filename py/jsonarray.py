@@ -0,0 +1,108 @@
+import re
+import json
+import codecs
+
+
+# Bytes read per refill; a refill after a failed decode asks for at least as
+# much again as is buffered, so an element larger than this is re-parsed only
+# a logarithmic number of times
+CHUNK_SIZE = 1 << 20
+
+WHITESPACE = ' \t\n\r'
+
+# Characters that may continue a number cut off at the end of the buffer
+NUMBER_TAIL = re.compile(r'[0-9.eE+-]*\Z')
+
+
+class ArrayReader:
+    """
+    Incrementally splits a binary stream holding a top-level JSON array into its elements.
+
+    Only the element being decoded (and at most one chunk of look-ahead) is kept
+    in memory, so huge arrays can be queried element by element.
+    """
+
+    def __init__(self, fin, encoding: str, chunk_size=CHUNK_SIZE):
+        self._fin = fin
+        self._decoder = codecs.getincrementaldecoder(encoding)()
+        self._json = json.JSONDecoder()
+        self._chunk_size = chunk_size
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self, size: int) -> bool:
+        """Appends at least size more bytes of decoded text to the buffer; returns False at end of input."""
+        if self._eof:
+            return False
+
+        raw = self._fin.read(size)
+        self._eof = not raw
+        text = self._decoder.decode(raw, final=self._eof)
+
+        # Drop everything already consumed while copying anyway
+        self._buf = self._buf[self._pos:] + text
+        self._pos = 0
+
+        return bool(text) or not self._eof
+
+    def _skip_whitespace(self) -> str:
+        """Returns the next non-whitespace character without consuming it, or '' at end of input."""
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in WHITESPACE:
+                self._pos += 1
+
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+
+            if not self._fill(self._chunk_size):
+                return ''
+
+    def _expect(self, chars: str) -> str:
+        c = self._skip_whitespace()
+        if c == '' or c not in chars:
+            raise ValueError(f"Expecting one of {chars!r}, found {c or 'end of input'!r}")
+
+        self._pos += 1
+        return c
+
+    def _decode_element(self):
+        """Returns (element, source text) for the element at the current position."""
+        while True:
+            try:
+                element, end = self._json.raw_decode(self._buf, self._pos)
+
+                # A number at the end of the buffer may continue in the next chunk
+                partial = isinstance(element, (int, float)) and not isinstance(element, bool) \
+                    and NUMBER_TAIL.match(self._buf, end) is not None
+
+                if not partial or self._eof:
+                    text = self._buf[self._pos:end]
+                    self._pos = end
+                    return element, text
+
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+
+            self._fill(max(self._chunk_size, len(self._buf) - self._pos))
+
+    def __iter__(self):
+        """Yields (index, element, source text) for every element of the array."""
+        self._expect('[')
+
+        if self._skip_whitespace() == ']':
+            self._pos += 1
+        else:
+            index = 0
+            while True:
+                self._skip_whitespace()
+                element, text = self._decode_element()
+                yield index, element, text
+                index += 1
+
+                if self._expect(',]') == ']':
+                    break
+
+        if self._skip_whitespace():
+            raise ValueError('Extra data after the top-level array')
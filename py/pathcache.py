@@ -0,0 +1,95 @@
+import os
+import json
+import sqlite3
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    valid INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS path_values (
+    path TEXT NOT NULL,
+    prop_path TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (path, prop_path)
+);
+'''
+
+
+class InvalidFile:
+    """Marker returned by PathCache.get() for files known not to be valid JSON."""
+
+
+class PathCache:
+    """
+    On-disk cache of get_value() results per (file, property-path).
+
+    Entries for a file are valid for as long as its mtime and size are unchanged.
+    """
+
+    def __init__(self, db_path: str):
+        # Autocommit, so that each put() is its own short transaction and
+        # several processes can share one cache
+        self._conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+
+    def get(self, path: str, stat: os.stat_result, prop_paths) -> dict:
+        """
+        Returns the cached values of prop_paths for path, keyed by property-path.
+
+        Returns None if the file changed or any value is missing, and InvalidFile
+        if the file is known not to be valid JSON.
+        """
+        path = os.path.abspath(path)
+
+        row = self._conn.execute('SELECT mtime_ns, size, valid FROM files WHERE path = ?', (path,)).fetchone()
+        if row is None or row[0] != stat.st_mtime_ns or row[1] != stat.st_size:
+            return None
+
+        if not row[2]:
+            return InvalidFile
+
+        values = {}
+        for prop_path in prop_paths:
+            value = self._conn.execute(
+                'SELECT value FROM path_values WHERE path = ? AND prop_path = ?', (path, prop_path)).fetchone()
+            if value is None:
+                return None
+
+            values[prop_path] = json.loads(value[0])
+
+        return values
+
+    def put(self, path: str, stat: os.stat_result, values: dict):
+        """Stores values (keyed by property-path) for path; values=None marks the file as invalid JSON."""
+        path = os.path.abspath(path)
+
+        self._conn.execute('BEGIN IMMEDIATE')
+
+        row = self._conn.execute('SELECT mtime_ns, size FROM files WHERE path = ?', (path,)).fetchone()
+        if row is None or row[0] != stat.st_mtime_ns or row[1] != stat.st_size:
+            logger.debug("Resetting cache entries for '%s'", path)
+            self._conn.execute('DELETE FROM path_values WHERE path = ?', (path,))
+
+        self._conn.execute(
+            'INSERT OR REPLACE INTO files (path, mtime_ns, size, valid) VALUES (?, ?, ?, ?)',
+            (path, stat.st_mtime_ns, stat.st_size, values is not None))
+
+        if values is not None:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO path_values (path, prop_path, value) VALUES (?, ?, ?)',
+                [(path, prop_path, json.dumps(value)) for prop_path, value in values.items()])
+
+        self._conn.execute('COMMIT')
+
+    def close(self):
+        self._conn.close()
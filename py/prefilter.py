@@ -0,0 +1,221 @@
+import re
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+
+# JSON may spell any character as a \uXXXX escape, so a literal can be present
+# in a document without appearing in its raw bytes
+UNICODE_ESCAPE = b'\\u'
+
+# The only non-ASCII characters whose casefold contains ASCII (as of Unicode 14):
+# ß İ ŉ ſ ǰ ẖ ẗ ẘ ẙ ẚ ẞ K and the ligatures ﬀ-ﬆ
+INSENSITIVE_UNSAFE = tuple(c.encode('utf-8') for c in (
+    '\u00df', '\u0130', '\u0149', '\u017f', '\u01f0', '\u1e96', '\u1e97', '\u1e98', '\u1e99', '\u1e9a',
+    '\u1e9e', '\u212a', '\ufb00', '\ufb01', '\ufb02', '\ufb03', '\ufb04', '\ufb05', '\ufb06',
+))
+
+# Values that str() can produce from non-string JSON values
+NON_STRING_REPRS = {'true', 'false', 'none'}
+
+
+class Rejected:
+    """Marker result for documents a prefilter rejected without decoding them."""
+
+
+class Condition:
+    """A condition that raw file bytes must satisfy for a document to possibly match."""
+
+    def test(self, raw) -> bool:
+        raise NotImplementedError
+
+
+class Contains(Condition):
+    def __init__(self, needle: str, insensitive=False):
+        self.needle = needle.encode('ascii')
+        self.insensitive = insensitive
+
+        if insensitive:
+            self._regex = re.compile(re.escape(self.needle), re.IGNORECASE)
+
+    def __repr__(self) -> str:
+        return f"Contains({self.needle!r}{', insensitive' if self.insensitive else ''})"
+
+    def test(self, raw: bytes) -> bool:
+        if self.insensitive:
+            return self._regex.search(raw) is not None
+
+        return raw.find(self.needle) != -1
+
+
+class AllOf(Condition):
+    def __init__(self, conditions: list):
+        self.conditions = conditions
+
+    def __repr__(self) -> str:
+        return f"AllOf({self.conditions!r})"
+
+    def test(self, raw: bytes) -> bool:
+        return all(c.test(raw) for c in self.conditions)
+
+
+class AnyOf(Condition):
+    def __init__(self, conditions: list):
+        self.conditions = conditions
+
+    def __repr__(self) -> str:
+        return f"AnyOf({self.conditions!r})"
+
+    def test(self, raw: bytes) -> bool:
+        return any(c.test(raw) for c in self.conditions)
+
+
+class Prefilter:
+    """
+    Rejects files from their raw bytes (or memory-mapped contents) before they are decoded.
+
+    A file is only rejected when the condition fails and nothing in the file
+    could hide a literal from a plain byte search.
+    """
+
+    def __init__(self, condition: Condition, insensitive: bool):
+        self.condition = condition
+        self._check_unsafe = insensitive
+
+    def __repr__(self) -> str:
+        return repr(self.condition)
+
+    def __call__(self, raw: bytes) -> bool:
+        if raw.find(UNICODE_ESCAPE) != -1:
+            return True
+
+        if self._check_unsafe and any(raw.find(u) != -1 for u in INSENSITIVE_UNSAFE):
+            return True
+
+        return self.condition.test(raw)
+
+
+def is_safe_literal(value: str) -> bool:
+    """Whether value is spelled the same in raw JSON bytes as in the decoded document."""
+    if not value or not value.isascii():
+        return False
+
+    return all(c.isprintable() and c not in '"\\/' for c in value)
+
+
+def is_string_only(value: str) -> bool:
+    """Whether str() of a non-string JSON value can never equal value (for --string)."""
+    if value.lower() in NON_STRING_REPRS or value[0] in '[{':
+        return False
+
+    try:
+        float(value)
+    except ValueError:
+        return True
+
+    return False
+
+
+def required_regex_literal(pattern: str):
+    """Returns the longest literal run every match of pattern must contain, if any."""
+    try:
+        parsed = sre_parse.parse(pattern)
+    except re.error:
+        return None
+
+    if parsed.state.flags & (re.IGNORECASE | re.VERBOSE):
+        return None
+
+    longest = ''
+    run = ''
+    for code, arg in parsed:
+        if code == sre_parse.LITERAL:
+            run += chr(arg)
+            continue
+
+        longest = max(longest, run, key=len)
+        run = ''
+
+    return max(longest, run, key=len) or None
+
+
+def build_condition(tree, is_path, insensitive=False, force_string=False):
+    """
+    Derives a necessary condition on raw bytes from an expression tree.
+
+    Returns None when nothing useful is known, e.g. under -not or for
+    capitalized (All) operators which can match empty arrays.
+    """
+    if not isinstance(tree, dict):
+        return None
+
+    for op, operands in tree.items():
+        lop = op.lower()
+
+        if lop == '-and' or lop == '-or':
+            if not all(isinstance(operand, dict) for operand in operands):
+                return None
+
+            conditions = [build_condition(operand, is_path, insensitive, force_string) for operand in operands]
+
+            if lop == '-and':
+                conditions = [c for c in conditions if c is not None]
+                if not conditions:
+                    return None
+                return conditions[0] if len(conditions) == 1 else AllOf(conditions)
+
+            if any(c is None for c in conditions):
+                return None
+            return AnyOf(conditions)
+
+        # Capitalized operators hold vacuously for empty arrays
+        if not op.islower():
+            return None
+
+        if lop == '-eq':
+            path, literal = operands
+            if not is_path(path) or not isinstance(literal, str) or is_path(literal):
+                return None
+
+            if not is_safe_literal(literal):
+                return None
+
+            if force_string and not is_string_only(literal):
+                return None
+
+            return Contains(literal, insensitive)
+
+        if lop == '-in':
+            literal, path = operands
+            if not is_path(path) or not isinstance(literal, str) or is_path(literal):
+                return None
+
+            if not is_safe_literal(literal):
+                return None
+
+            return Contains(literal)
+
+        if lop == '-mt' or lop == '-rx':
+            path, pattern = operands
+            if not is_path(path) or not isinstance(pattern, str) or is_path(pattern):
+                return None
+
+            literal = required_regex_literal(pattern)
+            if literal is None or not is_safe_literal(literal):
+                return None
+
+            return Contains(literal)
+
+        return None
+
+    return None
+
+
+def build_prefilter(tree, is_path, insensitive=False, force_string=False):
+    condition = build_condition(tree, is_path, insensitive, force_string)
+    if condition is None:
+        return None
+
+    return Prefilter(condition, insensitive)
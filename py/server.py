@@ -0,0 +1,91 @@
+import json
+import socket
+import logging
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+logger = logging.getLogger(__name__)
+
+
+class BadRequest(Exception):
+    """Raised by an answer() callback for requests that cannot be answered as given."""
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """
+    Answers POST /query, with a JSON object as the body, by the server's
+    answer(request) callback. Responses are JSON objects, with an 'error'
+    member for failed requests.
+    """
+
+    def do_POST(self):
+        if self.path != '/query':
+            self._respond(404, {'error': f"Unknown path '{self.path}'"})
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length))
+            if not isinstance(request, dict):
+                raise ValueError('Expected a JSON object')
+
+        except ValueError as e:
+            self._respond(400, {'error': f'Invalid request: {e}'})
+            return
+
+        try:
+            self._respond(200, self.server.answer(request))
+        except BadRequest as e:
+            self._respond(400, {'error': str(e)})
+        except Exception as e:
+            logger.exception('Could not answer %r', request)
+            self._respond(500, {'error': f'{type(e).__name__}: {e}'})
+
+    def _respond(self, status: int, body: dict):
+        data = json.dumps(body).encode('utf-8')
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self) -> str:
+        # Unix socket clients have no address
+        return self.client_address[0] if self.client_address else 'local'
+
+    def log_message(self, format, *args):
+        logger.info('%s - %s', self.address_string(), format % args)
+
+
+class QueryServer(ThreadingHTTPServer):
+    """Serves QueryHandler on localhost, each request in its own thread."""
+
+    daemon_threads = True
+
+    def __init__(self, port: int, answer):
+        super().__init__(('127.0.0.1', port), QueryHandler)
+        self.answer = answer
+
+    @property
+    def address(self) -> str:
+        return f'http://127.0.0.1:{self.server_port}/query'
+
+
+if hasattr(socket, 'AF_UNIX'):
+    class UnixQueryServer(socketserver.ThreadingUnixStreamServer):
+        """Serves QueryHandler on a Unix socket, each request in its own thread."""
+
+        daemon_threads = True
+
+        def __init__(self, path: str, answer):
+            super().__init__(path, QueryHandler)
+            self.answer = answer
+
+        @property
+        def address(self) -> str:
+            return f'{self.server_address} (POST /query)'
+
+else:
+    UnixQueryServer = None
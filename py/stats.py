@@ -0,0 +1,131 @@
+import json
+import time
+import heapq
+
+
+PHASES = ('discovery', 'read', 'prefilter', 'decode', 'evaluate')
+
+
+class Stats:
+    """
+    Timings and counters for a run, or for one worker's share of it (see merge()).
+
+    Operator timings are inclusive: an -and also counts the time of its operands.
+    """
+
+    def __init__(self, slowest=10):
+        self.slowest_count = slowest
+        self.wall = 0.0
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.files = 0
+        self.bytes_read = 0
+        self.parse_errors = 0
+        self.prefiltered = 0
+        self.indexed = 0
+        # {operator: [count, seconds]}, bound into compiled predicates
+        self.operators = {}
+        # Min-heap of (seconds, path)
+        self.slowest = []
+
+    def operator(self, op: str) -> list:
+        return self.operators.setdefault(op, [0, 0.0])
+
+    def lap(self, phase: str, since: float) -> float:
+        """Adds the time since since to phase and returns the current time."""
+        now = time.perf_counter()
+        self.phases[phase] += now - since
+        return now
+
+    def timed(self, phase: str, iterable):
+        """Yields from iterable, adding the time spent producing each item to phase."""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.lap(phase, start)
+
+            yield item
+
+    def add_file(self, path: str, seconds: float):
+        self.files += 1
+        self._keep_slowest(path, seconds)
+
+    def _keep_slowest(self, path: str, seconds: float):
+        if len(self.slowest) < self.slowest_count:
+            heapq.heappush(self.slowest, (seconds, path))
+        elif seconds > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (seconds, path))
+
+    def merge(self, other: 'Stats'):
+        for phase, seconds in other.phases.items():
+            self.phases[phase] += seconds
+
+        self.files += other.files
+        self.bytes_read += other.bytes_read
+        self.parse_errors += other.parse_errors
+        self.prefiltered += other.prefiltered
+        self.indexed += other.indexed
+
+        for op, (count, seconds) in other.operators.items():
+            counter = self.operator(op)
+            counter[0] += count
+            counter[1] += seconds
+
+        for seconds, path in other.slowest:
+            self._keep_slowest(path, seconds)
+
+    def reset(self):
+        """Zeroes everything in place, keeping operator counters bound into predicates."""
+        self.wall = 0.0
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.files = self.bytes_read = self.parse_errors = self.prefiltered = self.indexed = 0
+        self.slowest = []
+
+        for counter in self.operators.values():
+            counter[0] = 0
+            counter[1] = 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            'wall_seconds': self.wall,
+            'phase_seconds': dict(self.phases),
+            'files': self.files,
+            'bytes_read': self.bytes_read,
+            'parse_errors': self.parse_errors,
+            'prefiltered': self.prefiltered,
+            'indexed': self.indexed,
+            'operators': {op: {'count': count, 'seconds': seconds} for op, (count, seconds) in self.operators.items()},
+            'slowest': [{'path': path, 'seconds': seconds} for seconds, path in sorted(self.slowest, reverse=True)],
+        }
+
+    def format(self, fmt='text') -> str:
+        if fmt == 'json':
+            return json.dumps(self.to_dict(), indent=4)
+
+        lines = [f"Wall time: {self.wall:.3f}s"]
+
+        # Phases overlap across worker processes, so they may add up to more than the wall time
+        lines.append('Phases (summed over workers):')
+        for phase, seconds in self.phases.items():
+            lines.append(f"  {phase:<12} {seconds:10.3f}s")
+
+        lines.append(f"Files evaluated: {self.files} ({self.bytes_read} bytes read)")
+        lines.append(f"Rejected by prefilter: {self.prefiltered}")
+        lines.append(f"Answered by index: {self.indexed}")
+        lines.append(f"Skipped (parse errors): {self.parse_errors}")
+
+        if self.operators:
+            lines.append('Operators (inclusive time):')
+            for op, (count, seconds) in sorted(self.operators.items(), key=lambda item: -item[1][1]):
+                lines.append(f"  {op:<8} {count:10} calls {seconds:10.3f}s")
+
+        if self.slowest:
+            lines.append('Slowest files:')
+            for seconds, path in sorted(self.slowest, reverse=True):
+                lines.append(f"  {seconds * 1000:10.2f} ms  {path}")
+
+        return '\n'.join(lines)
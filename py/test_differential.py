@@ -0,0 +1,344 @@
+import os
+import re
+import json
+import random
+import logging
+import tempfile
+import unittest
+
+import jql
+from evaluators import SomeEvaluator as Some
+from evaluators import AllEvaluator as All
+from columns import ColumnStore
+from index import InvertedIndex, leaf_paths
+
+SEED = 20240601
+EXPRESSIONS = 300
+DOCUMENTS = 24
+
+KEYS = ('A', 'B', 'Name', 'Items', 'X1')
+VALUES = (0, 1, 5, 2.5, -3, True, False, 'Ghost', 'ghost', 'Crow', 'abc', '5', '', None, 'x.y', float('nan'), 5.0, -0.0, 1e300)
+LITERALS = ('5', '0', '2.5', 'true', 'False', 'Ghost', 'ghost', 'G.*t', '^C', 'abc', '[', '$1', '$2')
+BINARY = ('-eq', '-ne', '-lt', '-le', '-gt', '-ge', '-in', '-nin', '-mt', '-rx')
+UNARY = ('-ex', '-nex', '-len', '-obj', '-arr', '-str', '-num', '-bool')
+
+# Long enough for vectorized comparisons
+LONG_ARRAY = 300
+
+
+def random_value(rng: random.Random, depth: int):
+    r = rng.random()
+    if depth > 2 or r < 0.4:
+        return rng.choice(VALUES)
+    if r < 0.7:
+        return [random_value(rng, depth + 1) for _ in range(rng.randint(0, 4))]
+    return {key: random_value(rng, depth + 1) for key in rng.sample(KEYS, rng.randint(0, 4))}
+
+
+def random_document(rng: random.Random) -> dict:
+    document = {key: random_value(rng, 0) for key in rng.sample(KEYS, rng.randint(1, 5))}
+
+    if rng.random() < 0.2:
+        document['Items'] = [rng.choice((rng.randint(-10, 10), rng.uniform(-10, 10))) for _ in range(LONG_ARRAY)]
+
+    return document
+
+
+def random_path(rng: random.Random) -> str:
+    path = ''
+    # Mostly shallow paths, which most documents have
+    for _ in range(rng.choice((1, 1, 2, 3))):
+        path += '.' + rng.choice(KEYS)
+
+        r = rng.random()
+        if r < 0.3:
+            path += '[]'
+        elif r < 0.4:
+            path += f'[{rng.randint(0, 2)}]'
+
+    return path
+
+
+def random_tokens(rng: random.Random, depth=0) -> list:
+    case = str.upper if rng.random() < 0.3 else str
+    r = rng.random()
+
+    if depth < 3 and r < 0.3:
+        return [case(rng.choice(('-and', '-or')))] + random_tokens(rng, depth + 1) + random_tokens(rng, depth + 1)
+
+    if depth < 3 and r < 0.4:
+        return [case('-not')] + random_tokens(rng, depth + 1)
+
+    if r < 0.75:
+        a = [random_path(rng)] if rng.random() < 0.9 else random_tokens(rng, depth + 1)
+        b = [rng.choice(LITERALS)] if rng.random() < 0.8 else [random_path(rng)]
+        return [case(rng.choice(BINARY))] + a + b
+
+    return [case(rng.choice(UNARY)), random_path(rng)]
+
+
+def literal_tokens(rng: random.Random, document: dict):
+    """Returns an expression comparing a path of document against one of its own strings, or None."""
+    candidates = []
+    for path in leaf_paths(document):
+        try:
+            values = reference_value(document, path)
+        except (TypeError, KeyError, IndexError):
+            continue
+
+        candidates += [(path, value) for value in values or () if isinstance(value, str) and value]
+
+    if not candidates:
+        return None
+
+    path, value = rng.choice(candidates)
+    op = rng.choice(('-eq', '-mt', '-in'))
+
+    return [op, value, path] if op == '-in' else [op, path, value]
+
+
+# The evaluator every compiled path must agree with: the original tree-walking
+# evaluate() and get_value(), comparing through a three-way compare()
+
+ARRAY_PATH_REGEX = re.compile(r'^(?P<path>[A-Za-z0-9]+)\[(?P<idx>\d+)?\]$')
+
+
+def reference_value(json, prop_path: str):
+    curr = [json]
+    for path_el in prop_path.split('.')[1:]:
+        new_curr = []
+
+        for el in curr:
+            if el is None:
+                continue
+
+            m = ARRAY_PATH_REGEX.match(path_el)
+            if m:
+                path = m['path']
+                idx = m['idx']
+
+                if path not in el:
+                    return None
+
+                if idx is None:
+                    new_curr += el[path]
+                elif len(el[path]) <= int(idx):
+                    return None
+                else:
+                    new_curr.append(el[path][int(idx)])
+
+            elif path_el not in el:
+                return None
+
+            else:
+                new_curr.append(el[path_el])
+
+        curr = new_curr
+
+    return curr
+
+
+def reference_compare(insensitive: bool, force_string: bool):
+    def compare(a, b) -> int:
+        if force_string:
+            a = str(a)
+            b = str(b)
+
+        if insensitive:
+            a = a.lower() if isinstance(a, str) else a
+            b = b.lower() if isinstance(b, str) else b
+
+        if a < b:
+            return -1
+        elif a > b:
+            return 1
+        else:
+            return 0
+
+    return compare
+
+
+REFERENCE_CALLBACKS = {
+    '-not': lambda compare: lambda p: not p,
+    '-and': lambda compare: lambda a, b: a and b,
+    '-or': lambda compare: lambda a, b: a or b,
+    '-in': lambda compare: lambda a, b: a in b,
+    '-nin': lambda compare: lambda a, b: a not in b,
+    '-eq': lambda compare: lambda a, b: compare(a, b) == 0,
+    '-ne': lambda compare: lambda a, b: compare(a, b) != 0,
+    '-lt': lambda compare: lambda a, b: compare(a, b) < 0,
+    '-le': lambda compare: lambda a, b: compare(a, b) <= 0,
+    '-gt': lambda compare: lambda a, b: compare(a, b) > 0,
+    '-ge': lambda compare: lambda a, b: compare(a, b) >= 0,
+    '-len': lambda compare: len,
+    '-obj': lambda compare: lambda p: isinstance(p, dict),
+    '-arr': lambda compare: lambda p: isinstance(p, list),
+    '-str': lambda compare: lambda p: isinstance(p, str),
+    '-num': lambda compare: lambda p: isinstance(p, (int, float)),
+    '-bool': lambda compare: lambda p: isinstance(p, bool),
+}
+
+
+def reference_evaluate(json, tree, compare):
+    if jql.is_path(tree):
+        return reference_value(json, tree)
+
+    if not isinstance(tree, dict):
+        return tree
+
+    (op, operands), = tree.items()
+    lop = op.lower()
+    evaluate = Some.evaluate if op.islower() else All.evaluate
+    params = [reference_evaluate(json, operand, compare) for operand in operands]
+
+    if lop == '-ex':
+        return params[0] is not None
+
+    if lop == '-nex':
+        return params[0] is None
+
+    if lop == '-mt' or lop == '-rx':
+        if params[0] is None or params[1] is None:
+            return False
+
+        return evaluate(lambda a, b: re.search(b, a) is not None, *params)
+
+    return evaluate(REFERENCE_CALLBACKS[lop](compare), *params)
+
+
+def serializations(document) -> list:
+    """The raw bytes a document may be stored as, for checking prefilters."""
+    return [
+        json.dumps(document).encode('utf-8'),
+        json.dumps(document, ensure_ascii=False).encode('utf-8'),
+        json.dumps(document, indent=2).encode('utf-8'),
+    ]
+
+
+class DifferentialTest(unittest.TestCase):
+    """Every way of evaluating a query must give the reference result for every document."""
+
+    @classmethod
+    def setUpClass(cls):
+        logging.disable(logging.CRITICAL)
+
+        rng = random.Random(SEED)
+        cls.documents = [random_document(rng) for _ in range(DOCUMENTS)]
+        cls.expressions = [random_tokens(rng) for _ in range(EXPRESSIONS)]
+
+        # Random expressions rarely match, so prefilters also get expressions known to match some document
+        for document in cls.documents:
+            tokens = literal_tokens(rng, document)
+            if tokens is not None:
+                cls.expressions.append(tokens)
+
+        cls._dir = tempfile.TemporaryDirectory()
+        cls.files = []
+        for i, document in enumerate(cls.documents):
+            json_path = os.path.join(cls._dir.name, f'doc{i}.json')
+            with open(json_path, 'w') as fout:
+                json.dump(document, fout)
+            cls.files.append(json_path)
+
+        cls.index = InvertedIndex(os.path.join(cls._dir.name, 'index.db'))
+        prop_paths = set()
+        for document in cls.documents:
+            prop_paths.update(leaf_paths(document))
+        cls.index.clear(prop_paths)
+
+        compiled_paths = {prop_path: jql.PropertyPath(prop_path) for prop_path in prop_paths}
+        for json_path, document in zip(cls.files, cls.documents):
+            try:
+                values = {prop_path: jql.get_value(document, path) for prop_path, path in compiled_paths.items()}
+            except TypeError:
+                continue
+            cls.index.add_file(json_path, os.stat(json_path), values)
+
+        cls.index_ids = {json_path: entry[0] for json_path, entry in cls.index.files().items()}
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.index.close()
+        cls._dir.cleanup()
+        logging.disable(logging.NOTSET)
+
+    def queries(self):
+        """Yields (tokens, insensitive, force_string, query, [reference result, or None where it raises])."""
+        for tokens in self.expressions:
+            for insensitive in (False, True):
+                for force_string in (False, True):
+                    try:
+                        query = jql.compile_query(tokens, insensitive, force_string, prefilter=True)
+                    except jql.InvalidPathOrExpression:
+                        continue
+
+                    compare = reference_compare(insensitive, force_string)
+                    expected = []
+                    for document in self.documents:
+                        try:
+                            expected.append(reference_evaluate(document, query.tree, compare))
+                        except (TypeError, KeyError, IndexError):
+                            expected.append(None)
+
+                    yield tokens, insensitive, force_string, query, expected
+
+    def test_predicates(self):
+        for tokens, insensitive, force_string, query, expected in self.queries():
+            traced = jql.compile_query(tokens, insensitive, force_string, trace=True)
+
+            for document, reference in zip(self.documents, expected):
+                if reference is None:
+                    continue
+
+                with self.subTest(tokens=tokens, insensitive=insensitive, force_string=force_string, document=document):
+                    self.assertEqual(query.predicate(document), reference)
+                    self.assertEqual(traced.predicate(document), reference)
+                    self.assertEqual(query.values_predicate(jql.PathValues(document, query.paths)), reference)
+
+                    # As stored by --cache
+                    try:
+                        cached = json.loads(json.dumps(query.extract(document)))
+                    except TypeError:
+                        continue
+                    self.assertEqual(query.values_predicate(cached), reference)
+
+    def test_prefilter(self):
+        for tokens, insensitive, force_string, query, expected in self.queries():
+            if query.prefilter is None:
+                continue
+
+            for document, reference in zip(self.documents, expected):
+                if not reference:
+                    continue
+
+                with self.subTest(tokens=tokens, insensitive=insensitive, force_string=force_string, document=document):
+                    for raw in serializations(document):
+                        self.assertTrue(query.prefilter(raw))
+                        self.assertIs(jql.evaluate_raw(raw, '<document>', query), True)
+
+    def test_columns(self):
+        for tokens, insensitive, force_string, query, expected in self.queries():
+            rows = [i for i, reference in enumerate(expected) if reference is not None]
+            documents = [self.documents[i] for i in rows]
+
+            columns = ColumnStore(range(len(documents)), documents.__getitem__)
+            columns.add(list(query.paths), (jql.extract_file_values(document, query.paths) for document in documents))
+
+            with self.subTest(tokens=tokens, insensitive=insensitive, force_string=force_string):
+                self.assertEqual(query.evaluate_columns(columns), [bool(expected[i]) for i in rows])
+
+    def test_index(self):
+        for tokens, insensitive, force_string, query, expected in self.queries():
+            true_ids, unknown_ids = self.index.answer(query.tree, jql.is_path, insensitive, force_string)
+
+            for json_path, reference in zip(self.files, expected):
+                file_id = self.index_ids.get(json_path)
+                if reference is None or file_id is None or file_id in unknown_ids:
+                    continue
+
+                with self.subTest(tokens=tokens, insensitive=insensitive, force_string=force_string, file=json_path):
+                    self.assertEqual(file_id in true_ids, reference)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import os
+import sys
+import tempfile
+import unittest
+import subprocess
+
+JQL = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'jql.py')
+
+# Every encoding JSON may be written in (RFC 4627), with and without a BOM
+ENCODINGS = ('utf-8', 'utf-8-sig', 'utf-16', 'utf-16-le', 'utf-16-be', 'utf-32', 'utf-32-le', 'utf-32-be')
+
+
+def run_jql(*args) -> str:
+    return subprocess.run([sys.executable, JQL, *args], stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+
+
+class EncodingTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.root = self._dir.name
+
+        for encoding in ENCODINGS:
+            with open(os.path.join(self.root, f'{encoding}.json'), 'wb') as fout:
+                fout.write('{"Name": "Ghost"}'.encode(encoding))
+
+            with open(os.path.join(self.root, f'{encoding}.array'), 'wb') as fout:
+                fout.write('[{"Name": "Ghost"}, {"Name": "Arya"}]'.encode(encoding))
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def test_prefilter_passes_every_encoding(self):
+        expected = f'({len(ENCODINGS)}/{len(ENCODINGS)} files match)'
+
+        for args in ((), ('--no-prefilter',)):
+            with self.subTest(args=args):
+                output = run_jql(self.root, '--include', '*.json', *args, '-eq', '.Name', 'Ghost')
+                self.assertEqual(output.splitlines()[-1], expected)
+
+    def test_elements_in_every_encoding(self):
+        output = run_jql(self.root, '--include', '*.array', '--elements', '-eq', '.Name', 'Ghost')
+        self.assertEqual(output.splitlines()[-1], f'({len(ENCODINGS)}/{2 * len(ENCODINGS)} records match)')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Shorter lists are compared faster by the evaluators than they are converted
+MIN_LENGTH = 256
+
+# Integers beyond this may change value when converted to float64
+EXACT_LIMIT = 2 ** 53
+
+# Same truth tables as the three-way comparisons of comparers.py, NaN included
+TESTS = {
+    '-eq': lambda a, b: ~(a < b) & ~(a > b),
+    '-ne': lambda a, b: (a < b) | (a > b),
+    '-lt': lambda a, b: a < b,
+    '-le': lambda a, b: (a < b) | ~(a > b),
+    '-gt': lambda a, b: ~(a < b) & (a > b),
+    '-ge': lambda a, b: ~(a < b),
+}
+
+
+def compile_vector_test(lop: str, literal, path_first: bool, every: bool):
+    """
+    Returns a function that compares a list of values against literal in one
+    array operation, reducing with all() if every else any().
+
+    The function returns None for lists that are not all numbers (or could
+    lose precision as float64), which must then be compared one by one.
+    Returns None instead of a function if NumPy is not installed or the
+    comparison cannot be vectorized.
+    """
+    if numpy is None or lop not in TESTS:
+        return None
+
+    if type(literal) is int:
+        if abs(literal) > EXACT_LIMIT:
+            return None
+    elif type(literal) is not float:
+        return None
+
+    test = TESTS[lop]
+
+    def vector_test(values: list):
+        if len(values) < MIN_LENGTH:
+            return None
+
+        try:
+            array = numpy.array(values)
+        except (ValueError, OverflowError):
+            return None
+
+        # Strings, nulls, objects and nested arrays make an object (or non-numeric) array
+        if array.ndim != 1 or array.dtype.kind not in 'bif':
+            return None
+
+        # Mixing floats in (from the data or the literal) converts integers to float64
+        if (array.dtype.kind == 'f' or type(literal) is float) and (numpy.abs(array) > EXACT_LIMIT).any():
+            return None
+
+        mask = test(array, literal) if path_first else test(literal, array)
+
+        return bool(mask.all() if every else mask.any())
+
+    return vector_test